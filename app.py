@@ -1,16 +1,30 @@
 # import library
 import dash
-from dash import Dash, html, dcc, Input, Output, State, dash_table, callback
+from dash import Dash, html, dcc, Input, Output, State, dash_table, callback, MATCH, Patch
 import dash_bootstrap_components as dbc
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 import numpy as np
-from scipy import  stats
-import plotly.graph_objects as go
 import plotly.figure_factory as ff
-import plotly.express as px
 from plotly.subplots import make_subplots
-import base64
-import io
+import json
+from functools import partial
+from datastore import get_dataset
+from upload import upload_blueprint
+from table_query import query_page
+from descriptive import describe_dataset
+from binning import HISTOGRAM_BIN_RULE, HISTOGRAM_NBINS, histogram_dataset
+from frequency import value_counts_dataset, frequency_table_dataset, estimated_frequency_table
+from density import DENSITY_ROW_THRESHOLD, density_grid
+from figures import bar_figure, scatter_figure, line_figure, density_figure, correlation_figure
+from decimate import DECIMATE_METHOD, LINE_POINTS, longitudinal_axis_dataset, line_points, zoom_range
+from lazy_cards import paginated_cards, register_lazy_cards
+from sort_index import sorted_columns
+from correlation import correlation_dataset
+from sampling import is_sampled, sample_frame, sample_value_counts, sample_statistics, correlation_interval
+from incremental import approximate_statistics
+from result_cache import cached_result
+from timing import metrics_blueprint, timed
 
 # style of all body
 basic_style = {
@@ -54,6 +68,14 @@ contents_style = {
     "z-index": "0",
 }
 
+# text if dataset is no longer kept on server
+expired_text = html.P(
+    "※ファイルを再度選択してください",
+    style = {
+        "color": "#DC5258"
+    }
+)
+
 # instance dash app
 app = Dash(
     __name__,
@@ -63,6 +85,10 @@ app = Dash(
 
 server = app.server
 
+# streaming upload endpoint
+server.register_blueprint(upload_blueprint)
+server.register_blueprint(metrics_blueprint)
+
 # headers
 headers = html.Div(
     [
@@ -77,8 +103,8 @@ headers = html.Div(
                 "display": "inline-block"
             }
         ),
-        # button of file upload
-        dcc.Upload(
+        # button of file upload (streamed by assets/upload.js)
+        html.Div(
             id = "file-select-button",
             children = html.A(
                         "ファイルを選択",
@@ -99,6 +125,36 @@ headers = html.Div(
                 "display": "inline-block"
             }
         ),
+        # button of rows appended to the dataset (streamed by assets/upload.js)
+        html.Div(
+            id = "append-select-button",
+            children = html.A(
+                        "行を追加",
+                        style = {
+                            "display": "block",
+                            'width': '120px',
+                            "height": "32px",
+                            "border": "solid 1px #AEAAAA",
+                            "border-radius": "2px",
+                            "text-align": "center",
+                            "padding-top": "6px",
+                            "cursor": "pointer",
+                        }
+                    ),
+            style = {
+                "margin-top": "12px",
+                "margin-left": "12px",
+                "display": "inline-block"
+            }
+        ),
+        # dataset handle returned by the upload endpoint
+        dcc.Input(
+            id = "upload-handle",
+            type = "text",
+            style = {
+                "display": "none"
+            }
+        ),
         # space of text filename or alert
         html.Div(
             id = "text-filename",
@@ -108,6 +164,23 @@ headers = html.Div(
                 "display": "inline-block"
             }
         ),
+        # error of rows appended (the dataset shown is kept)
+        dcc.Input(
+            id = "append-error",
+            type = "text",
+            style = {
+                "display": "none"
+            }
+        ),
+        # space of alert of rows appended
+        html.Div(
+            id = "text-append-error",
+            style = {
+                "padding-top": "18px",
+                "padding-left": "24px",
+                "display": "inline-block"
+            }
+        ),
     ],
     style = {
         "display": "flex",
@@ -209,6 +282,10 @@ app.title = "MediSight"
 app.layout = html.Div(
     id = "body-container",
     children = [
+        # id of uploaded dataset kept on server
+        dcc.Store(
+            id = "dataset-id"
+        ),
         html.Div(
             headers,
         ),
@@ -233,48 +310,71 @@ app.layout = html.Div(
 
 
 # callback when tab select
-@callback(
+# runs in the browser, so switching tabs sends no request to the server
+app.clientside_callback(
+    """
+    function(tab, datasetId) {
+        // if not file selected, only the data table contents space is visible
+        var selected = datasetId ? tab : "data-table-tab";
+        return [
+            "data-table-tab",
+            "one-variable-graph-tab",
+            "two-variable-graph-tab",
+            "longitudinal-graph-tab"
+        ].map(function (value) {
+            return {"visibility": value === selected ? "visible" : "hidden"};
+        });
+    }
+    """,
     Output("data-table-contents-space", "style"),
     Output("one-variable-graph-contents-space", "style"),
     Output("two-variable-graph-contents-space", "style"),
     Output("longitudinal-graph-contents-space", "style"),
     Input("tabs-contents-display", "value"),
-    State("file-select-button", "contents"),
+    State("dataset-id", "data"),
 )
-def tab_selected_view(tab, contents):
-    # if file selected
-    if contents:
-        if tab == "data-table-tab":
-            return {"visibility": "visible"}, {"visibility": "hidden"}, {"visibility": "hidden"}, {"visibility": "hidden"}
-        elif tab == "one-variable-graph-tab":
-            return {"visibility": "hidden"}, {"visibility": "visible"}, {"visibility": "hidden"}, {"visibility": "hidden"}
-        elif tab == "two-variable-graph-tab":
-            return {"visibility": "hidden"}, {"visibility": "hidden"}, {"visibility": "visible"}, {"visibility": "hidden"}
-        elif tab == "longitudinal-graph-tab":
-            return {"visibility": "hidden"}, {"visibility": "hidden"}, {"visibility": "hidden"}, {"visibility": "visible"}
-    # if not file selected
-    else:
-        return {"visibility": "visible"}, {"visibility": "hidden"}, {"visibility": "hidden"}, {"visibility": "hidden"}
 
 
-# callback when csv file select
+# callback when rows could not be appended
+# alert space｜view error text (the dataset shown is kept)
+@callback(
+    Output("text-append-error", "children"),
+    Input("append-error", "value"),
+)
+def append_error_view(append_error):
+    if not append_error:
+        return None
+    return html.P(
+        append_error,
+        style = {
+            "color": "#DC5258"
+        }
+    )
+
+
+# callback when csv file uploaded
 # data table contents space｜view space title and data table
 # one variable graph contents space｜view space title and dropdown of select quaritative variable
 # two variable graph contents space｜view space title and dropdown of select axis type and variable
 # longitudinal graph contents space｜view space title and dropdown of select longitudinal variable
 @callback(
+    Output("dataset-id", "data"),
     Output("text-filename", "children"),
     Output("data-table-contents-space", "children"),
     Output("one-variable-graph-contents-space", "children"),
     Output("two-variable-graph-contents-space", "children"),
     Output("longitudinal-graph-contents-space", "children"),
-    Input("file-select-button", "contents"),
-    State("file-select-button", "filename")
+    Input("upload-handle", "value"),
 )
-def data_table_view(contents, filename):
+def data_table_view(upload_handle):
+    # dataset handle of uploaded file
+    handle = json.loads(upload_handle) if upload_handle else {}
+    dataset_id = handle.get("dataset_id")
+    filename = handle.get("filename")
+
     # text if not file selected
     non_text_select = html.P(
-        "※ファイルを選択してください",
+        handle.get("error", "※ファイルを選択してください"),
         style = {
             "color": "#DC5258"
         }
@@ -285,12 +385,12 @@ def data_table_view(contents, filename):
         filename
     )
 
-    # if file selected
-    if contents:
-        content_type, content_string = contents.split(",")
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
+    # parsed once by the upload endpoint and kept on server
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
 
+    # if file selected
+    if df is not None:
         # generate the data table
         selected_data_table = html.Div(
             [
@@ -306,11 +406,12 @@ def data_table_view(contents, filename):
                 html.Div(
                     dash_table.DataTable(
                         id = "table",
-                        data = df.to_dict("records"),
                         columns = [
                             {"name": i, "id": i} for i in df.columns
                         ],
+                        page_current = 0,
                         page_size = 15,
+                        page_action = "custom",
                         style_cell = {
                             "text-align": "center",
                             "max-width": "80px",
@@ -328,8 +429,11 @@ def data_table_view(contents, filename):
                             "min-width": "100%",
                             'overflowX': 'auto'
                         },
-                        sort_action = "native",
+                        sort_action = "custom",
                         sort_mode = "multi",
+                        sort_by = [],
+                        filter_action = "custom",
+                        filter_query = "",
                     ),
                     style = {
                         "border-radius": "2px",
@@ -378,6 +482,18 @@ def data_table_view(contents, filename):
                                 "margin-right": "40px"
                             }
                         ),
+                        dcc.Checklist(
+                            id = "one-variable-preview",
+                            options = [
+                                {"value": "preview", "label": "高速プレビュー"}
+                            ],
+                            value = [],
+                            style = {
+                                "display": "inline-block",
+                                "margin-top": "8px",
+                                "margin-right": "16px"
+                            }
+                        ),
                         html.Button(
                             '各変数の情報を表示',
                             id = 'one-variable-graph-view',
@@ -474,6 +590,18 @@ def data_table_view(contents, filename):
                                 "width": "36px"
                             }
                         ),
+                        dcc.Checklist(
+                            id = "two-variable-preview",
+                            options = [
+                                {"value": "preview", "label": "高速プレビュー"}
+                            ],
+                            value = [],
+                            style = {
+                                "display": "inline-block",
+                                "margin-top": "8px",
+                                "margin-right": "16px"
+                            }
+                        ),
                         html.Button(
                             '2変数の関係性を表示',
                             id = 'two-variable-graph-view',
@@ -490,6 +618,39 @@ def data_table_view(contents, filename):
                                 "margin-top": "2px"
                             }
                         ),
+                        # 全ての量的データの相関行列
+                        dcc.Dropdown(
+                            id = "correlation-method",
+                            options = [
+                                {"value": "pearson", "label": "Pearsonの相関係数"},
+                                {"value": "spearman", "label": "Spearmanの順位相関係数"}
+                            ],
+                            value = "pearson",
+                            clearable = False,
+                            multi = False,
+                            style = {
+                                "display": "inline-block",
+                                "width": "200px",
+                                "margin-left": "40px",
+                                "margin-right": "8px"
+                            }
+                        ),
+                        html.Button(
+                            '相関行列を表示',
+                            id = 'correlation-view',
+                            n_clicks = 0,
+                            style = {
+                                "border": "none",
+                                "border-radius": "2px",
+                                "text-align": "center",
+                                "width": "160px",
+                                "height": "32px",
+                                "background-color": "#2b4b78",
+                                "color": "#ffffff",
+                                "display": "inline-block",
+                                "margin-top": "2px"
+                            }
+                        ),
                     ],
                     style = {
                         "display": "flex",
@@ -571,535 +732,688 @@ def data_table_view(contents, filename):
             }
         )
 
-        return text_filename, selected_data_table, one_variable_graph_info, two_variable_graph_info, longitudinal_graph_info
+        return dataset_id, text_filename, selected_data_table, one_variable_graph_info, two_variable_graph_info, longitudinal_graph_info
     else:
-        return non_text_select, None, None, None, None
+        return None, non_text_select, None, None, None, None
 
 
-# callback when click button of view one variable graph
-# one graph contents space | view one variable graph and data info
+# callback when page, sort or filter of data table changed
+# data table｜view only the current page of the sorted and filtered data
 @callback(
-    Output("one-variable-graph-space", "children"),
-    Input("one-variable-graph-view", "n_clicks"),
-    State("qualitative-variable", "value"),
-    State("file-select-button", "contents"),
+    Output("table", "data"),
+    Output("table", "page_count"),
+    Input("table", "page_current"),
+    Input("table", "page_size"),
+    Input("table", "sort_by"),
+    Input("table", "filter_query"),
+    State("dataset-id", "data"),
 )
-def view_one_variable_graph(n_clicks, qualitative_variable, contents):
-    if n_clicks:
-        content_type, content_string = contents.split(",")
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-        
-        histograms = []
-
-        for col in df.columns:
-            df_sorted = df.sort_values(
-                by = col,
-                ascending = True
+def data_table_page_view(page_current, page_size, sort_by, filter_query, dataset_id):
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
+    if df is None:
+        return [], 1
+
+    with timed("query"):
+        return query_page(df, dataset_id, page_current, page_size, sort_by, filter_query)
+
+
+# text of statistic, with its 95% interval if estimated from a sample
+def stat_text(col_stats, intervals, name, approximate = ()):
+    text = "{:.2f}".format(col_stats[name])
+    if name in approximate:
+        text = "≈" + text
+    if name in intervals:
+        text += "（{:.2f}–{:.2f}）".format(*intervals[name])
+    return text
+
+
+# card of one variable｜view one variable graph and data info
+# with preview, statistics are estimated from a sample of the dataset
+# (None if the dataset is small enough not to be sampled)
+def one_variable_card(params, col, preview = False):
+    dataset_id = params["dataset_id"]
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
+    if df is None:
+        return expired_text
+    if preview and not is_sampled(df):
+        return None
+
+    # 標本による概算の場合は見出しに表示
+    preview_text = "（標本による概算・値は95％信頼区間）" if preview else ""
+
+    # 質的データの場合
+    if col in params["qualitative_variable"]:
+        with timed("stats"):
+            if preview:
+                # 標本の度数から全体の度数と相対度数の信頼区間を推定
+                labels, sample_counts, scale = sample_value_counts(dataset_id, df, col)
+                counts = sample_counts * scale
+                table_data = estimated_frequency_table(col, labels, sample_counts, scale, len(df))
+            else:
+                # 値ごとの度数をサーバー側で集計（符号化した値のbincountを1回だけ計算）
+                labels, counts = value_counts_dataset(dataset_id, df, col)
+
+                # 質的データの度数、相対度数、累積相対度数（同じ度数から計算）
+                table_data = frequency_table_dataset(dataset_id, df, col)
+
+        with timed("figure"):
+            hist_fig = bar_figure(
+                labels,
+                counts,
+                col,
+                category = True
             )
-            # 質的データの場合
-            if col in qualitative_variable:
-                hist_fig = px.histogram(
-                    df_sorted,
-                    x = col,
-                    nbins = 24,
-                    color_discrete_sequence = ["#2b4b78"],
-                )
 
-                hist_fig.update_layout(
-                    paper_bgcolor = '#ffffff',
-                    plot_bgcolor = '#ffffff',
-                )
+        # DashのDataTableコンポーネントを作成
+        data_table = dash_table.DataTable(
+            data = table_data.to_dict('records'),
+            columns = [{'name': i, 'id': i} for i in table_data.columns],
+            page_size = 10,
+            style_cell = {
+                "text-align": "center",
+                "max-width": "80px",
+                "min-width": "80px",
+                "white-space": "normal",
+                "border-bottom": "solid 0.5px #AEAAAA"
+            },
+            style_as_list_view = True,
+            style_header = {
+                "background-color": "#ffffff",
+                'font-weight': 'bold',
+                "border-bottom": "solid 1.5px #AEAAAA"
+            },
+            style_table = {
+                "min-width": "100%",
+                'overflowX': 'auto'
+            },
+        )
 
-                # X軸とY軸の線を設定
-                hist_fig.update_xaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                   linecolor = '#AEAAAA'
-                )
-                hist_fig.update_yaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                   linecolor = '#AEAAAA'
+        return html.Div(
+            [
+                html.Div(
+                    html.H3(
+                        "{}の分布と度数分布表{}".format(col, preview_text),
+                        style = {
+                            "font-size": "12pt",
+                            "margin": "16px 0px 0px 40px"
+                        }
+                    )
+                ),
+                html.Div(
+                    [
+                        html.Div(
+                            dcc.Graph(
+                                figure = hist_fig
+                            ),
+                            style = {
+                                "width": "50%",
+                                "display": "inline-block",
+                                "margin": "8px",
+                            }
+                        ),
+                        html.Div(
+                            data_table,
+                            style = {
+                                "width": "50%",
+                                "display": "inline-block",
+                                "margin": "40px 8px 8px 8px"
+                            }
+                        )
+                    ],
+                    style = {
+                        "display": "flex"
+                    }
                 )
+            ],
+            style = {
+                "border-radius": "2px",
+                "border": "solid 0.5px #AEAAAA",
+                "margin": "0px 16px 16px 0px",
+                "width": "1200px",
+                "height": "520px"
+            }
+        )
 
-                # 質的データの度数、相対度数、累積相対度数を計算
-                value_counts = df[col].value_counts()
-                relative_freq = df[col].value_counts(normalize = True).round(2)
-                cumulative_freq = df[col].value_counts(normalize = True).cumsum().round(2)
-
-                # データをDashのDataTableに整形
-                table_data = pd.DataFrame({
-                    col: value_counts.index,
-                    '度数': value_counts.values,
-                    '相対度数': relative_freq.values,
-                    '累積相対度数': cumulative_freq.values
-                })
-
-                # DashのDataTableコンポーネントを作成
-                data_table = dash_table.DataTable(
-                    data = table_data.to_dict('records'),
-                    columns = [{'name': i, 'id': i} for i in table_data.columns],
-                    page_size = 10,
-                    style_cell = {
-                        "text-align": "center",
-                        "max-width": "80px",
-                        "min-width": "80px",
-                        "white-space": "normal",
-                        "border-bottom": "solid 0.5px #AEAAAA"
-                    },
-                    style_as_list_view = True,
-                    style_header = {
-                        "background-color": "#ffffff",
-                        'font-weight': 'bold',
-                        "border-bottom": "solid 1.5px #AEAAAA"
-                    },
-                    style_table = {
-                        "min-width": "100%",
-                        'overflowX': 'auto'
-                    },
-                )
+    # 量的データの場合
+    # 基本統計量とヒストグラムは全ての量的データについてまとめて計算
+    with timed("stats"):
+        if preview:
+            describe, numeric_histograms, intervals = sample_statistics(dataset_id, df, col)
+        else:
+            describe = describe_dataset(dataset_id, df)
+            numeric_histograms = histogram_dataset(dataset_id, df)
+            intervals = {}
+
+    # ビンの境界と度数のみをサーバー側で計算
+    if col in numeric_histograms:
+        edges, counts = numeric_histograms[col]
+        with timed("figure"):
+            hist_fig = bar_figure(
+                (edges[:-1] + edges[1:]) / 2,
+                counts,
+                col,
+                width = np.diff(edges)
+            )
+    # 数値でない列
+    else:
+        with timed("stats"):
+            if preview:
+                labels, counts, scale = sample_value_counts(dataset_id, df, col)
+                counts = counts * scale
+            else:
+                labels, counts = value_counts_dataset(dataset_id, df, col)
+        with timed("figure"):
+            hist_fig = bar_figure(
+                labels,
+                counts,
+                col
+            )
+
+    # 量的データの基本統計量（計算済み）
+    if col in describe.index:
+        col_stats = describe.loc[col]
+        # 行の追加後にヒストグラムから概算した統計量には「≈」を付ける
+        approximate = [] if preview else approximate_statistics(dataset_id).get(col, [])
+        if approximate:
+            preview_text = "（≈：行の追加後にヒストグラムから概算した値）"
+        # 整数の列の最頻値は整数で表示
+        if df[col].dtype.kind in "biu" and not np.isnan(col_stats["mode"]):
+            mode_text = "{}".format(int(col_stats["mode"]))
+        else:
+            mode_text = "{}".format(col_stats["mode"])
+        if "mode" in approximate:
+            mode_text = "≈" + mode_text
+        values = [
+            stat_text(col_stats, intervals, name, approximate)
+            for name in ["mean", "median"]
+        ] + [mode_text] + [
+            stat_text(col_stats, intervals, name, approximate)
+            for name in ["max", "min", "std", "skew", "kurtosis", "q25", "q50", "q75"]
+        ]
+    # 数値でない列
+    else:
+        values = ["-"] * 11
+
+    stats_data = {
+        "基本統計量": ["平均", "中央値", "最頻値", "最大値", "最小値", "標準偏差", "歪度", "尖度", "25％四分位点", "50％四分位点", "75％四分位点"],
+        "値": values
+    }
+    stats_df = pd.DataFrame(stats_data)
+
+    # DashのDataTableコンポーネントを作成
+    stats_table = dash_table.DataTable(
+        data = stats_df.to_dict('records'),
+        columns=[{'name': i, 'id': i} for i in stats_df.columns],
+        style_cell = {
+            "text-align": "center",
+            "max-width": "80px",
+            "min-width": "80px",
+            "white-space": "normal",
+            "border-bottom": "solid 0.5px #AEAAAA"
+        },
+        style_as_list_view = True,
+        style_header = {
+            "background-color": "#ffffff",
+            'font-weight': 'bold',
+            "border-bottom": "solid 1.5px #AEAAAA"
+        },
+        style_table = {
+            "min-width": "100%",
+            'overflowX': 'auto'
+        },
+    )
 
-                histograms.append(
+    return html.Div(
+        [
+            html.Div(
+                html.H3(
+                    "{}の分布と基本統計量{}".format(col, preview_text),
+                    style = {
+                        "font-size": "12pt",
+                        "margin": "16px 0px 0px 40px"
+                    }
+                )
+            ),
+            html.Div(
+                [
                     html.Div(
-                        [
-                            html.Div(
-                                html.H3(
-                                    "{}の分布と度数分布表".format(col),
-                                    style = {
-                                        "font-size": "12pt",
-                                        "margin": "16px 0px 0px 40px"
-                                    }
-                                )
-                            ),
-                            html.Div(
-                                [
-                                    html.Div(
-                                        dcc.Graph(
-                                            figure = hist_fig
-                                        ),
-                                        style = {
-                                            "width": "50%",
-                                            "display": "inline-block",
-                                            "margin": "8px",
-                                        }
-                                    ),
-                                    html.Div(
-                                        data_table,
-                                        style = {
-                                            "width": "50%",
-                                            "display": "inline-block",
-                                            "margin": "40px 8px 8px 8px"
-                                        }
-                                    )
-                                ],
-                                style = {
-                                    "display": "flex"
-                                }
-                            )
-                            
-                        ],
+                        dcc.Graph(
+                            figure = hist_fig
+                        ),
                         style = {
-                            "border-radius": "2px",
-                            "border": "solid 0.5px #AEAAAA",
-                            "margin": "0px 16px 16px 0px",
-                            "width": "1200px",
-                            "height": "520px"
+                            "width": "50%",
+                            "display": "inline-block",
+                            "margin": "8px"
+                        }
+                    ),
+                    html.Div(
+                        stats_table,
+                        style = {
+                            "width": "50%",
+                            "display": "inline-block",
+                            "margin": "40px 8px 8px 8px",
                         }
                     )
-                )
-                
-            # 量的データの場合
+                ],
+                style = {
+                    "display": "flex"
+                }
+            )
+        ],
+        style = {
+            "border-radius": "2px",
+            "border": "solid 0.5px #AEAAAA",
+            "margin": "0px 16px 16px 0px",
+            "width": "1200px",
+            "height": "520px"
+        }
+    )
+
+
+# card of two variables｜view two variable graph
+# with preview, the graph is drawn from a sample of the dataset
+# (None if the dataset is small enough not to be sampled)
+def two_variable_card(params, col, preview = False):
+    dataset_id = params["dataset_id"]
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
+    if df is None:
+        return expired_text
+    if preview and not is_sampled(df):
+        return None
+
+    # 選択した変数をX軸またはY軸に設定
+    if params["axis_type"] == "xaxis":
+        x_col, y_col = params["axis_variable"], col
+    else:
+        x_col, y_col = col, params["axis_variable"]
+
+    title = "{}（X軸）と{}（Y軸）の分布".format(x_col, y_col)
+    if preview:
+        # X軸が質的データの場合は値ごとに層別した標本
+        stratify = None if is_numeric_dtype(df[x_col]) else x_col
+        with timed("stats"):
+            sample = sample_frame(dataset_id, df, [x_col, y_col], stratify)
+        scale = len(df) / max(len(sample), 1)
+
+        # 量的データどうしは相関係数と95％信頼区間を表示
+        title += "（標本による概算"
+        if is_numeric_dtype(df[x_col]) and is_numeric_dtype(df[y_col]):
+            pairs = sample[[x_col, y_col]].dropna()
+            r = pairs[x_col].corr(pairs[y_col])
+            title += "：r = {:.2f}、95％信頼区間 {:.2f}–{:.2f}".format(r, *correlation_interval(r, len(pairs)))
+        title += "）"
+        df = sample
+
+    # 行数が多い場合は2次元の度数分布（密度）で表示
+    if len(df) > DENSITY_ROW_THRESHOLD:
+        with timed("stats"):
+            grid = density_grid(df[x_col], df[y_col])
+            # 標本の度数は全体の度数に換算
+            if preview:
+                grid["z"] = grid["z"] * scale
+        with timed("figure"):
+            scat_fig = density_figure(
+                grid,
+                x_col,
+                y_col
+            )
+    else:
+        # X軸の変数で並べ替えた2列のみを取り出す（並べ替えの順序は計算済み）
+        with timed("sort"):
+            if preview:
+                sorted_df = df.sort_values(x_col, kind = "stable", na_position = "last")
+                sorted_values = {c: sorted_df[c].to_numpy() for c in (x_col, y_col)}
             else:
-                hist_fig = px.histogram(
-                    df_sorted,
-                    x = col,
-                    nbins = 24,
-                    color_discrete_sequence = ["#2b4b78"]
-                )
+                sorted_values = sorted_columns(dataset_id, df, x_col, [x_col, y_col])
+
+        with timed("figure"):
+            scat_fig = scatter_figure(
+                sorted_values[x_col],
+                sorted_values[y_col],
+                x_col,
+                y_col
+            )
 
-                hist_fig.update_layout(
-                    paper_bgcolor = '#ffffff',
-                    plot_bgcolor = '#ffffff'
+    return html.Div(
+        [
+            html.Div(
+                html.H3(
+                    title,
+                    style = {
+                        "font-size": "12pt",
+                        "margin": "16px 0px 0px 40px"
+                    }
                 )
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        dcc.Graph(
+                            figure = scat_fig
+                        ),
+                        style = {
+                            "width": "96%",
+                            "margin": "8px"
+                        }
+                    ),
+                ]
+            )
+        ],
+        style = {
+            "border-radius": "2px",
+            "border": "solid 0.5px #AEAAAA",
+            "margin": "0px 2px 16px 0px",
+            "width": "1200px",
+            "height": "520px"
+        }
+    )
 
-                # X軸とY軸の線を設定
-                hist_fig.update_xaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                   linecolor = '#AEAAAA'
-                )
-                hist_fig.update_yaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                   linecolor = '#AEAAAA'
-                )
 
-                # 量的データの基本統計量を計算
-                stats_data = {
-                    "基本統計量": ["平均", "中央値", "最頻値", "最大値", "最小値", "標準偏差", "歪度", "尖度", "25％四分位点", "50％四分位点", "75％四分位点"],
-                    "値": [
-                        "{:.2f}".format(np.mean(df[col])),
-                        "{:.2f}".format(np.median(df[col])),
-                        "{}".format(stats.mode(df[col])[0]),
-                        "{:.2f}".format(np.max(df[col])),
-                        "{:.2f}".format(np.min(df[col])),
-                        "{:.2f}".format(np.std(df[col], ddof=1)),
-                        "{:.2f}".format(stats.skew(df[col])),
-                        "{:.2f}".format(stats.kurtosis(df[col])),
-                        "{:.2f}".format(np.percentile(df[col], 25)),
-                        "{:.2f}".format(np.percentile(df[col], 50)),
-                        "{:.2f}".format(np.percentile(df[col], 75))
-                    ]
-                }
-                stats_df = pd.DataFrame(stats_data)
-
-                # DashのDataTableコンポーネントを作成
-                stats_table = dash_table.DataTable(
-                    data = stats_df.to_dict('records'),
-                    columns=[{'name': i, 'id': i} for i in stats_df.columns],
-                    style_cell = {
-                        "text-align": "center",
-                        "max-width": "80px",
-                        "min-width": "80px",
-                        "white-space": "normal",
-                        "border-bottom": "solid 0.5px #AEAAAA"
-                    },
-                    style_as_list_view = True,
-                    style_header = {
-                        "background-color": "#ffffff",
-                        'font-weight': 'bold',
-                        "border-bottom": "solid 1.5px #AEAAAA"
-                    },
-                    style_table = {
-                        "min-width": "100%",
-                        'overflowX': 'auto'
-                    },
-                )
+# card of longitudinal variable｜view longitudinal graph
+def longitudinal_card(params, col):
+    dataset_id = params["dataset_id"]
+    longitudinal_variable = params["longitudinal_variable"]
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
+    if df is None:
+        return expired_text
+
+    # 時系列データで並べ替えた順序（データセットごとに1回だけ計算）
+    with timed("sort"):
+        axis = longitudinal_axis_dataset(dataset_id, df, longitudinal_variable)
+
+    # 山と谷を残して点数を間引く
+    with timed("decimate"):
+        x, y = line_points(axis, df[col])
+    with timed("figure"):
+        line_scatter = line_figure(
+            x,
+            y,
+            longitudinal_variable,
+            col,
+            uirevision = col
+        )
 
-                histograms.append(
+    return html.Div(
+        [
+            html.Div(
+                html.H3(
+                    "{}の時系列データ".format(col),
+                    style = {
+                        "font-size": "12pt",
+                        "margin": "16px 0px 0px 40px"
+                    }
+                )
+            ),
+            html.Div(
+                [
                     html.Div(
-                        [
-                            html.Div(
-                                html.H3(
-                                    "{}の分布と基本統計量".format(col),
-                                    style = {
-                                        "font-size": "12pt",
-                                        "margin": "16px 0px 0px 40px"
-                                    }
-                                )
-                            ),
-                            html.Div(
-                                [
-                                    html.Div(
-                                        dcc.Graph(
-                                            figure = hist_fig
-                                        ),
-                                        style = {
-                                            "width": "50%",
-                                            "display": "inline-block",
-                                            "margin": "8px"
-                                        }
-                                    ),
-                                    html.Div(
-                                        stats_table,
-                                        style = {
-                                            "width": "50%",
-                                            "display": "inline-block",
-                                            "margin": "40px 8px 8px 8px",
-                                        }
-                                    )
-                                ],
-                                style = {
-                                    "display": "flex"
-                                }
-                            ) 
-                        ],
+                        dcc.Graph(
+                            id = {"type": "longitudinal-graph", "column": col},
+                            figure = line_scatter
+                        ),
                         style = {
-                            "border-radius": "2px",
-                            "border": "solid 0.5px #AEAAAA",
-                            "margin": "0px 16px 16px 0px",
-                            "width": "1200px",
-                            "height": "520px"
+                            "width": "96%",
+                            "margin": "8px"
                         }
-                    )
-                )
+                    ),
+                ]
+            )
+        ],
+        style = {
+            "border-radius": "2px",
+            "border": "solid 0.5px #AEAAAA",
+            "margin": "0px 2px 16px 0px",
+            "width": "1200px",
+            "height": "520px"
+        }
+    )
 
-        # Wrapping histgrams in a row div
-        histograms_layout = html.Div(
-            histograms,
-        )
 
-        return histograms_layout
+# keys of cards in the result cache (dataset, chart kind, column and parameters)
+# cards of expired datasets are not cached
+def one_variable_card_key(params, col):
+    if get_dataset(params["dataset_id"]) is None:
+        return None
+    if col in params["qualitative_variable"]:
+        return (params["dataset_id"], "one-variable", col, "qualitative")
+    return (params["dataset_id"], "one-variable", col, "quantitative", HISTOGRAM_BIN_RULE, HISTOGRAM_NBINS)
+
+
+def two_variable_card_key(params, col):
+    if get_dataset(params["dataset_id"]) is None:
+        return None
+    return (params["dataset_id"], "two-variable", col, params["axis_variable"], params["axis_type"], DENSITY_ROW_THRESHOLD)
+
+
+def longitudinal_card_key(params, col):
+    if get_dataset(params["dataset_id"]) is None:
+        return None
+    return (params["dataset_id"], "longitudinal", col, params["longitudinal_variable"], DECIMATE_METHOD, LINE_POINTS)
+
+
+# cards are built one by one when their page is shown
+# (a page being built is cancelled when its view button is clicked again)
+# (with preview, cards from samples are shown until the exact ones are built)
+register_lazy_cards(
+    "one-variable-graph", one_variable_card, one_variable_card_key,
+    cancel = [Input("one-variable-graph-view", "n_clicks")],
+    build_preview = partial(one_variable_card, preview = True)
+)
+register_lazy_cards(
+    "two-variable-graph", two_variable_card, two_variable_card_key,
+    cancel = [Input("two-variable-graph-view", "n_clicks")],
+    build_preview = partial(two_variable_card, preview = True)
+)
+register_lazy_cards(
+    "longitudinal-graph", longitudinal_card, longitudinal_card_key,
+    cancel = [Input("longitudinal-graph-view", "n_clicks")]
+)
+
+
+# callback when click button of view one variable graph
+# one graph contents space | view pages of one variable cards
+@callback(
+    Output("one-variable-graph-space", "children"),
+    Input("one-variable-graph-view", "n_clicks"),
+    State("qualitative-variable", "value"),
+    State("dataset-id", "data"),
+    State("one-variable-preview", "value"),
+)
+def view_one_variable_graph(n_clicks, qualitative_variable, dataset_id, preview = None):
+    if n_clicks:
+        df = get_dataset(dataset_id)
+        if df is None:
+            return expired_text
+
+        params = {
+            "dataset_id": dataset_id,
+            "qualitative_variable": qualitative_variable or [],
+            "preview": bool(preview),
+        }
+        return paginated_cards("one-variable-graph", params, list(df.columns))
 
 
 # callback when click button of view two variable graph
-# two graph contents space｜view two variable graph
+# two graph contents space｜view pages of two variable cards
 @callback(
     Output("two-variable-graph-space", "children"),
     Input("two-variable-graph-view", "n_clicks"),
-    State("file-select-button", "contents"),
+    State("dataset-id", "data"),
     State("axis-variable", "value"),
-    State("axis-type", "value")
+    State("axis-type", "value"),
+    State("two-variable-preview", "value"),
 )
-def view_two_variable_graph(n_clicks, contents, axis_variable, axis_type):
+def view_two_variable_graph(n_clicks, dataset_id, axis_variable, axis_type, preview = None):
     if n_clicks:
-        content_type, content_string = contents.split(",")
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-
-        scatters = []
-
-        if axis_type == "xaxis":
-            for col in df.columns:
-                if col != axis_variable:
-                    df_sorted = df.sort_values(
-                        by = axis_variable,
-                        ascending = True
-                    )
-
-                    scat_fig = px.scatter(
-                        df_sorted,
-                        x = axis_variable,
-                        y = col
-                    )
+        df = get_dataset(dataset_id)
+        if df is None:
+            return expired_text
+
+        if axis_type in ("xaxis", "yaxis"):
+            columns = [col for col in df.columns if col != axis_variable]
+        else:
+            columns = []
+
+        params = {
+            "dataset_id": dataset_id,
+            "axis_variable": axis_variable,
+            "axis_type": axis_type,
+            "preview": bool(preview),
+        }
+        return paginated_cards("two-variable-graph", params, columns)
 
-                    scat_fig.update_layout(
-                        paper_bgcolor = '#ffffff',
-                        plot_bgcolor = '#ffffff'
-                    )
 
-                    # X軸とY軸の線を設定
-                    scat_fig.update_xaxes(
-                        showline = True,
-                        linewidth = 0.5,
-                    linecolor = '#AEAAAA'
-                    )
-                    scat_fig.update_yaxes(
-                        showline = True,
-                        linewidth = 0.5,
-                    linecolor = '#AEAAAA'
-                    )
-
-                    # 散布図のマーカーの色を設定
-                    scat_fig.update_traces(
-                        marker = dict(
-                            color = "#2b4b78",
-                            size = 4
-                        ) # ここで色とサイズを設定
-                    )
+# callback when click button of view correlation matrix
+# two graph contents space｜view heatmap of correlations of all quantitative variables
+@callback(
+    Output("two-variable-graph-space", "children", allow_duplicate = True),
+    Input("correlation-view", "n_clicks"),
+    State("correlation-method", "value"),
+    State("dataset-id", "data"),
+    prevent_initial_call = True,
+)
+def view_correlation_matrix(n_clicks, method, dataset_id):
+    if n_clicks:
+        with timed("dataset"):
+            df = get_dataset(dataset_id)
+        if df is None:
+            return expired_text
+
+        # 全ての量的データの組の相関係数をまとめて計算（データセットごとに1回だけ計算）
+        with timed("stats"):
+            matrix = correlation_dataset(dataset_id, df, method)
+        with timed("figure"):
+            corr_fig = correlation_figure(
+                matrix,
+                "r" if method == "pearson" else "ρ"
+            )
 
-                    scatters.append(
-                        html.Div(
-                            [
-                                html.Div(
-                                    html.H3(
-                                        "{}（X軸）と{}（Y軸）の分布".format(axis_variable, col),
-                                        style = {
-                                            "font-size": "12pt",
-                                            "margin": "16px 0px 0px 40px"
-                                        }
-                                    )
-                                ),
-                                html.Div(
-                                    [
-                                        html.Div(
-                                            dcc.Graph(
-                                                figure = scat_fig
-                                            ),
-                                            style = {
-                                                "width": "96%",
-                                                "margin": "8px"
-                                            }
-                                        ),
-                                    ]
-                                ) 
-                            ],
+        return html.Div(
+            [
+                html.Div(
+                    [
+                        html.H3(
+                            "量的データの相関行列（{}）".format("Pearson" if method == "pearson" else "Spearman"),
                             style = {
-                                "border-radius": "2px",
-                                "border": "solid 0.5px #AEAAAA",
-                                "margin": "0px 2px 16px 0px",
-                                "width": "1200px",
-                                "height": "520px"
+                                "font-size": "12pt",
+                                "margin": "16px 0px 0px 40px"
                             }
-                        )
-                    )
-        
-        elif axis_type == "yaxis":
-            for col in df.columns:
-                if col != axis_variable:
-                    df_sorted = df.sort_values(
-                        by = col,
-                        ascending = True
-                    )
-                    
-                    scat_fig = px.scatter(
-                        df_sorted,
-                        x = col,
-                        y = axis_variable
-                    )
-
-                    # グラフの背景色と線の色を設定
-                    scat_fig.update_layout(
-                        paper_bgcolor = '#ffffff',
-                        plot_bgcolor = '#ffffff'
-                    )
-
-                    # X軸とY軸の線を設定
-                    scat_fig.update_xaxes(
-                        showline = True,
-                        linewidth = 0.5,
-                    linecolor = '#AEAAAA'
-                    )
-                    scat_fig.update_yaxes(
-                        showline = True,
-                        linewidth = 0.5,
-                    linecolor = '#AEAAAA'
-                    )
-
-                    # 散布図のマーカーの色を設定
-                    scat_fig.update_traces(
-                        marker = dict(
-                            color = "#2b4b78",
-                            size = 4
-                        ) # ここで色とサイズを設定
-                    )
-
-                    scatters.append(
+                        ),
+                        html.P(
+                            "※セルをクリックすると2変数の散布図を表示します",
+                            style = {
+                                "font-size": "10pt",
+                                "margin": "8px 0px 0px 40px"
+                            }
+                        ),
                         html.Div(
-                            [
-                                html.Div(
-                                    html.H3(
-                                        "{}（X軸）と{}（Y軸）の分布".format(col, axis_variable),
-                                        style = {
-                                            "font-size": "12pt",
-                                            "margin": "16px 0px 0px 40px"
-                                        }
-                                    )
-                                ),
-                                html.Div(
-                                    [
-                                        html.Div(
-                                            dcc.Graph(
-                                                figure = scat_fig
-                                            ),
-                                            style = {
-                                                "width": "96%",
-                                                "margin": "8px"
-                                            }
-                                        ),
-                                    ]
-                                ) 
-                            ],
+                            dcc.Graph(
+                                id = "correlation-graph",
+                                figure = corr_fig
+                            ),
                             style = {
-                                "border-radius": "2px",
-                                "border": "solid 0.5px #AEAAAA",
-                                "margin": "0px 2px 16px 0px",
-                                "width": "1200px",
-                                "height": "520px"
+                                "width": "96%",
+                                "margin": "8px"
                             }
-                        )
-                    )
-
-        scatters_layout = html.Div(
-            scatters,
+                        ),
+                    ],
+                    style = {
+                        "border-radius": "2px",
+                        "border": "solid 0.5px #AEAAAA",
+                        "margin": "0px 2px 16px 0px",
+                        "width": "1200px"
+                    }
+                ),
+                html.Div(
+                    id = "correlation-scatter"
+                ),
+            ]
         )
-            
-        return scatters_layout
+
+
+# callback when click cell of correlation matrix
+# correlation scatter｜view card of the clicked pair of variables
+@callback(
+    Output("correlation-scatter", "children"),
+    Input("correlation-graph", "clickData"),
+    State("dataset-id", "data"),
+)
+def view_correlation_pair(click_data, dataset_id):
+    if not click_data:
+        return None
+
+    point = click_data["points"][0]
+    x_col, y_col = point["x"], point["y"]
+    if x_col == y_col:
+        return dash.no_update
+
+    params = {
+        "dataset_id": dataset_id,
+        "axis_variable": x_col,
+        "axis_type": "xaxis",
+    }
+    key = two_variable_card_key(params, y_col)
+    if key is None:
+        return expired_text
+    return cached_result(key, lambda: two_variable_card(params, y_col))
 
 
 # callback when click button of view longitudinal graph
-# longitudinal graph contents space｜view longitudinal graph
+# longitudinal graph contents space｜view pages of longitudinal cards
 @callback(
     Output("longitudinal-graph-space", "children"),
     Input("longitudinal-graph-view", "n_clicks"),
     State("longitudinal-variable", "value"),
-    State("file-select-button", "contents")
+    State("dataset-id", "data")
 )
-def view_longitudinal_graph(n_clicks, longitudinal_variable, contents):
+def view_longitudinal_graph(n_clicks, longitudinal_variable, dataset_id):
     if n_clicks:
-        content_type, content_string = contents.split(",")
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-
-        df_sorted = df.sort_values(
-            by = longitudinal_variable,
-            ascending = True
-        )
-
-        line_scatters = []
-
-        for col in df_sorted.columns:
-            if col != longitudinal_variable:
-                line_scatter = px.line(
-                    df_sorted,
-                    x = longitudinal_variable,
-                    y = col,
-                )
-
-                # グラフの背景色と線の色を設定
-                line_scatter.update_layout(
-                    paper_bgcolor = '#ffffff',
-                    plot_bgcolor = '#ffffff'
-                )
+        df = get_dataset(dataset_id)
+        if df is None:
+            return expired_text
 
-                # X軸とY軸の線を設定
-                line_scatter.update_xaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                linecolor = '#AEAAAA'
-                )
-                line_scatter.update_yaxes(
-                    showline = True,
-                    linewidth = 0.5,
-                linecolor = '#AEAAAA'
-                )
+        params = {
+            "dataset_id": dataset_id,
+            "longitudinal_variable": longitudinal_variable,
+        }
+        columns = [col for col in df.columns if col != longitudinal_variable]
+        return paginated_cards("longitudinal-graph", params, columns)
 
-                line_scatter.update_traces(
-                    line = dict(color = "#2b4b78")
-                )
 
-                line_scatters.append(
-                    html.Div(
-                        [
-                            html.Div(
-                                html.H3(
-                                    "{}の時系列データ".format(col),
-                                    style = {
-                                        "font-size": "12pt",
-                                        "margin": "16px 0px 0px 40px"
-                                    }
-                                )
-                            ),
-                            html.Div(
-                                [
-                                    html.Div(
-                                        dcc.Graph(
-                                            figure = line_scatter
-                                        ),
-                                        style = {
-                                            "width": "96%",
-                                            "margin": "8px"
-                                        }
-                                    ),
-                                ]
-                            ) 
-                        ],
-                        style = {
-                            "border-radius": "2px",
-                            "border": "solid 0.5px #AEAAAA",
-                            "margin": "0px 2px 16px 0px",
-                            "width": "1200px",
-                            "height": "520px"
-                        }
-                    )
-                )
-        
-        line_scatters_layout = html.Div(
-            line_scatters,
-        )
-            
-        return line_scatters_layout
+# callback when longitudinal graph zoomed
+# longitudinal graph｜re-decimate only the visible range
+@callback(
+    Output({"type": "longitudinal-graph", "column": MATCH}, "figure"),
+    Input({"type": "longitudinal-graph", "column": MATCH}, "relayoutData"),
+    State({"type": "longitudinal-graph", "column": MATCH}, "id"),
+    State("longitudinal-graph-params", "data"),
+    prevent_initial_call = True,
+)
+def zoom_longitudinal_graph(relayout_data, graph_id, params):
+    dataset_id = params["dataset_id"]
+    with timed("dataset"):
+        df = get_dataset(dataset_id)
+    if df is None or graph_id["column"] not in df.columns:
+        return dash.no_update
+
+    with timed("sort"):
+        axis = longitudinal_axis_dataset(dataset_id, df, params["longitudinal_variable"])
+    changed, x_range = zoom_range(relayout_data, axis)
+    if not changed:
+        return dash.no_update
+
+    with timed("decimate"):
+        x, y = line_points(axis, df[graph_id["column"]], x_range)
+
+    # 線のデータのみを更新
+    line_scatter = Patch()
+    line_scatter["data"][0]["x"] = x.tolist()
+    line_scatter["data"][0]["y"] = y.tolist()
+    return line_scatter
 
 
 # app start
@@ -0,0 +1,117 @@
+// streaming upload of the selected file
+// the file is posted to /upload in chunks (no base64 in callbacks),
+// and the returned dataset handle is passed to dash through #upload-handle
+// rows appended with #append-select-button go to the current dataset
+(function () {
+    // size of one chunk (bytes)
+    var CHUNK_SIZE = 8 * 1024 * 1024;
+
+    // random id of one upload (32 hex characters)
+    function newUploadId() {
+        var bytes = new Uint8Array(16);
+        window.crypto.getRandomValues(bytes);
+        return Array.prototype.map.call(bytes, function (b) {
+            return ("0" + b.toString(16)).slice(-2);
+        }).join("");
+    }
+
+    // set value of the hidden dcc.Input so that dash fires the callback
+    function setInput(id, value) {
+        var input = document.getElementById(id);
+        var setter = Object.getOwnPropertyDescriptor(
+            window.HTMLInputElement.prototype, "value"
+        ).set;
+        setter.call(input, value);
+        input.dispatchEvent(new Event("input", {bubbles: true}));
+    }
+
+    function setHandle(handle) {
+        setInput("upload-handle", JSON.stringify(handle));
+    }
+
+    // alert of rows not appended ("" to clear), the dataset shown is kept
+    function setAppendError(error) {
+        setInput("append-error", error);
+    }
+
+    // post chunks one after another
+    function postChunk(uploadId, file, offset) {
+        var chunk = file.slice(offset, offset + CHUNK_SIZE);
+        return fetch("/upload/" + uploadId + "?offset=" + offset, {
+            method: "POST",
+            headers: {"Content-Type": "application/octet-stream"},
+            body: chunk
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error("upload failed");
+            }
+            var next = offset + chunk.size;
+            if (next < file.size) {
+                return postChunk(uploadId, file, next);
+            }
+        });
+    }
+
+    // dataset handle currently shown (empty if none)
+    function currentHandle() {
+        var value = document.getElementById("upload-handle").value;
+        try {
+            return value ? JSON.parse(value) : {};
+        } catch (e) {
+            return {};
+        }
+    }
+
+    // upload file as new dataset, or append its rows to dataset base
+    function upload(file, base) {
+        var uploadId = newUploadId();
+        var query = "?filename=" + encodeURIComponent(file.name);
+        if (base) {
+            query += "&append_to=" + encodeURIComponent(base.dataset_id);
+        }
+        var error = base ? "※行を追加できませんでした" : "※ファイルを読み込めませんでした";
+        setAppendError("");
+        return postChunk(uploadId, file, 0).then(function () {
+            return fetch("/upload/" + uploadId + "/complete" + query, {method: "POST"});
+        }).then(function (response) {
+            return response.json();
+        }).then(function (handle) {
+            if (base) {
+                if (!handle.dataset_id) {
+                    setAppendError(handle.error || error);
+                    return;
+                }
+                handle.filename = base.filename + " + " + file.name;
+            }
+            setHandle(handle);
+        }).catch(function () {
+            if (base) {
+                setAppendError(error);
+            } else {
+                setHandle({upload_id: uploadId, error: error});
+            }
+        });
+    }
+
+    // open file dialog when the file select (or append) button is clicked
+    document.addEventListener("click", function (event) {
+        var append = event.target.closest("#append-select-button");
+        if (!append && !event.target.closest("#file-select-button")) {
+            return;
+        }
+        var base = append ? currentHandle() : null;
+        if (append && !base.dataset_id) {
+            setAppendError("※先にファイルを選択してください");
+            return;
+        }
+        var input = document.createElement("input");
+        input.type = "file";
+        input.accept = ".csv,.gz,.zip,.parquet,.feather,.arrow";
+        input.addEventListener("change", function () {
+            if (input.files.length) {
+                upload(input.files[0], base);
+            }
+        });
+        input.click();
+    });
+})();
@@ -0,0 +1,478 @@
+# benchmark of callbacks over synthetic clinical datasets
+# every stage of the app (upload, data table, one variable, two variables,
+# longitudinal) is run directly and through the Flask test client of
+# app.server. wall time, peak memory (tracemalloc) and payload bytes are
+# written to a JSON report, which can be compared with a previous one.
+#
+#   python benchmarks/run.py --rows 1000 100000 --output report.json
+#   python benchmarks/run.py --compare baseline.json --output report.json
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import synthetic_csv
+
+# variables selected in the views
+TIME_COLUMN = "visit_date"
+AXIS_COLUMN = "lab_01"
+
+# interval of polling background callbacks (same as the dash renderer)
+POLL_SECONDS = 0.5
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description = "benchmark of MediSight callbacks")
+    parser.add_argument("--rows", type = int, nargs = "+", default = [1000, 100000])
+    parser.add_argument("--numeric", type = int, default = 10)
+    parser.add_argument("--categorical", type = int, default = 5)
+    parser.add_argument("--nan-ratio", type = float, default = 0.05)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--modes", nargs = "+", choices = ["direct", "http"], default = ["direct", "http"])
+    parser.add_argument("--output", default = "benchmark-report.json")
+    parser.add_argument("--compare", help = "previous report to compare with")
+    return parser.parse_args()
+
+
+# import the app with on-disk caches in a fresh directory
+def _load_app():
+    os.environ.setdefault("MEDISIGHT_DATA_DIR", tempfile.mkdtemp(prefix = "medisight-bench-"))
+    os.environ.setdefault("MEDISIGHT_RESULT_CACHE_DIR", tempfile.mkdtemp(prefix = "medisight-bench-results-"))
+    import app
+    return app
+
+
+# run fn (returning payload bytes) and measure it
+def _measure(fn):
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    payload_bytes = fn()
+    seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    return {
+        "seconds": seconds,
+        "peak_bytes": peak_bytes,
+        "payload_bytes": payload_bytes,
+    }
+
+
+def _json_bytes(result):
+    from plotly.io.json import to_json_plotly
+    return len(to_json_plotly(result).encode("utf-8"))
+
+
+# params and columns of the first page, as stored by paginated_cards
+def _first_page(view, cards_per_page):
+    params = view.children[0].data
+    return params, params["columns"][:cards_per_page]
+
+
+# stages called as python functions
+def _direct_stages(app, csv_bytes, qualitative):
+    from datastore import load_file
+    from lazy_cards import CARDS_PER_PAGE
+
+    state = {}
+
+    def load():
+        path = os.path.join(tempfile.gettempdir(), "medisight-bench.csv")
+        with open(path, "wb") as f:
+            f.write(csv_bytes)
+        try:
+            state["dataset_id"], _ = load_file(path)
+        finally:
+            os.remove(path)
+        return len(csv_bytes)
+
+    def data_table():
+        handle = json.dumps({"dataset_id": state["dataset_id"], "filename": "synthetic.csv"})
+        return _json_bytes(app.data_table_view(handle))
+
+    def table_page_sorted():
+        sort_by = [{"column_id": AXIS_COLUMN, "direction": "desc"}]
+        return _json_bytes(app.data_table_page_view(3, 15, sort_by, "", state["dataset_id"]))
+
+    def view_cards(view, build_card):
+        params, columns = _first_page(view, CARDS_PER_PAGE)
+        return _json_bytes(view) + sum(_json_bytes(build_card(params, col)) for col in columns)
+
+    def one_variable():
+        view = app.view_one_variable_graph(1, qualitative, state["dataset_id"])
+        return view_cards(view, app.one_variable_card)
+
+    def two_variable():
+        view = app.view_two_variable_graph(1, state["dataset_id"], AXIS_COLUMN, "xaxis")
+        return view_cards(view, app.two_variable_card)
+
+    def longitudinal():
+        view = app.view_longitudinal_graph(1, TIME_COLUMN, state["dataset_id"])
+        return view_cards(view, app.longitudinal_card)
+
+    def correlation():
+        return sum(
+            _json_bytes(app.view_correlation_matrix(1, method, state["dataset_id"]))
+            for method in ("pearson", "spearman")
+        )
+
+    return [
+        ("load", load),
+        ("data_table", data_table),
+        ("table_page_sorted", table_page_sorted),
+        ("one_variable", one_variable),
+        ("two_variable", two_variable),
+        ("longitudinal", longitudinal),
+        ("correlation", correlation),
+    ]
+
+
+# id of output as sent by the dash renderer
+def _id_string(id_):
+    if isinstance(id_, dict):
+        return json.dumps(id_, sort_keys = True, separators = (",", ":"))
+    return id_
+
+
+# one update of /_dash-update-component
+# background callbacks are polled until their job is done
+# return JSON of the final response and bytes of all responses (progress
+# responses included)
+# (output: key of the callback, needed for outputs with allow_duplicate;
+# changed: index of the input that changed)
+def _dash_update(client, output, outputs, inputs, state = (), changed = 0):
+    if output is not None:
+        output_string = output
+    else:
+        output_string = ".." + "...".join(
+            "{}.{}".format(_id_string(o["id"]), o["property"]) for o in outputs
+        ) + ".."
+    body = {
+        "output": output_string,
+        "outputs": outputs,
+        "inputs": inputs,
+        "state": list(state),
+        "changedPropIds": ["{}.{}".format(_id_string(inputs[changed]["id"]), inputs[changed]["property"])],
+    }
+
+    query = {}
+    nbytes = 0
+    while True:
+        response = client.post("/_dash-update-component", query_string = query, json = body)
+        if response.status_code not in (200, 202, 204):
+            raise RuntimeError("{} {}: {}".format(output_string, response.status_code, response.data[:200]))
+        nbytes += len(response.data)
+        result = response.get_json(silent = True) or {}
+        if "cacheKey" in result:
+            query = {"cacheKey": result["cacheKey"], "job": result["job"]}
+        elif not query or "response" in result or response.status_code == 204:
+            return result, nbytes
+        time.sleep(POLL_SECONDS)
+
+
+def _prop(id_, prop, value = None):
+    return {"id": id_, "property": prop, "value": value}
+
+
+# stages called through the Flask test client
+def _http_stages(app, csv_bytes, qualitative):
+    import io
+
+    client = app.server.test_client()
+    state = {}
+
+    def load():
+        response = client.post(
+            "/upload",
+            data = {"file": (io.BytesIO(csv_bytes), "synthetic.csv")},
+            content_type = "multipart/form-data",
+        )
+        if response.status_code != 200:
+            raise RuntimeError("upload {}: {}".format(response.status_code, response.data[:200]))
+        state["handle"] = response.get_data(as_text = True)
+        state["dataset_id"] = response.get_json()["dataset_id"]
+        return len(response.data)
+
+    def data_table():
+        outputs = [
+            {"id": "dataset-id", "property": "data"},
+            {"id": "text-filename", "property": "children"},
+            {"id": "data-table-contents-space", "property": "children"},
+            {"id": "one-variable-graph-contents-space", "property": "children"},
+            {"id": "two-variable-graph-contents-space", "property": "children"},
+            {"id": "longitudinal-graph-contents-space", "property": "children"},
+        ]
+        return _dash_update(client, None, outputs, [_prop("upload-handle", "value", state["handle"])])[1]
+
+    def table_page_sorted():
+        sort_by = [{"column_id": AXIS_COLUMN, "direction": "desc"}]
+        return _dash_update(
+            client,
+            None,
+            [
+                {"id": "table", "property": "data"},
+                {"id": "table", "property": "page_count"},
+            ],
+            [
+                _prop("table", "page_current", 3),
+                _prop("table", "page_size", 15),
+                _prop("table", "sort_by", sort_by),
+                _prop("table", "filter_query", ""),
+            ],
+            [_prop("dataset-id", "data", state["dataset_id"])],
+        )[1]
+
+    # view button and its first page, as the browser requests them
+    def view_cards(prefix, button_inputs, button_state):
+        view, view_bytes = _dash_update(
+            client,
+            prefix + "-space.children",
+            {"id": prefix + "-space", "property": "children"},
+            button_inputs,
+            button_state,
+        )
+        params = view["response"][prefix + "-space"]["children"]["props"]["children"][0]["props"]["data"]
+
+        # cached pages come back right away, other pages start the job
+        page_inputs = [
+            _prop(prefix + "-pagination", "active_page", 1),
+            _prop(prefix + "-stages", "data"),
+        ]
+        page, page_bytes = _dash_update(
+            client,
+            None,
+            [
+                {"id": prefix + "-cards", "property": "children"},
+                {"id": prefix + "-job", "property": "data"},
+            ],
+            page_inputs,
+            [_prop(prefix + "-params", "data", params)],
+        )
+        job = page["response"].get(prefix + "-job", {}).get("data")
+        if job is None:
+            return view_bytes + page_bytes
+
+        # cards of the page are built by a background callback
+        output = next(
+            key for key in app.app.callback_map
+            if prefix + "-cards.children@" in key
+        )
+        built, built_bytes = _dash_update(
+            client,
+            output,
+            [
+                {"id": prefix + "-cards", "property": "children"},
+                {"id": prefix + "-stages", "property": "data"},
+            ],
+            [_prop(prefix + "-job", "data", job)],
+            [_prop(prefix + "-params", "data", params)],
+        )
+        # stages of the job, sent back as the browser does
+        page_inputs[1]["value"] = built["response"][prefix + "-stages"]["data"]
+        _dash_update(
+            client,
+            None,
+            [
+                {"id": prefix + "-cards", "property": "children"},
+                {"id": prefix + "-job", "property": "data"},
+            ],
+            page_inputs,
+            [_prop(prefix + "-params", "data", params)],
+            changed = 1,
+        )
+        return view_bytes + page_bytes + built_bytes
+
+    def one_variable():
+        return view_cards(
+            "one-variable-graph",
+            [_prop("one-variable-graph-view", "n_clicks", 1)],
+            [
+                _prop("qualitative-variable", "value", qualitative),
+                _prop("dataset-id", "data", state["dataset_id"]),
+                _prop("one-variable-preview", "value", []),
+            ],
+        )
+
+    def two_variable():
+        return view_cards(
+            "two-variable-graph",
+            [_prop("two-variable-graph-view", "n_clicks", 1)],
+            [
+                _prop("dataset-id", "data", state["dataset_id"]),
+                _prop("axis-variable", "value", AXIS_COLUMN),
+                _prop("axis-type", "value", "xaxis"),
+                _prop("two-variable-preview", "value", []),
+            ],
+        )
+
+    def longitudinal():
+        return view_cards(
+            "longitudinal-graph",
+            [_prop("longitudinal-graph-view", "n_clicks", 1)],
+            [
+                _prop("longitudinal-variable", "value", TIME_COLUMN),
+                _prop("dataset-id", "data", state["dataset_id"]),
+            ],
+        )
+
+    def correlation():
+        # output of allow_duplicate is registered with a suffix
+        output = next(
+            key for key in app.app.callback_map
+            if key.startswith("two-variable-graph-space.children@")
+        )
+        return sum(
+            _dash_update(
+                client,
+                output,
+                {"id": "two-variable-graph-space", "property": "children"},
+                [_prop("correlation-view", "n_clicks", 1)],
+                [
+                    _prop("correlation-method", "value", method),
+                    _prop("dataset-id", "data", state["dataset_id"]),
+                ],
+            )[1]
+            for method in ("pearson", "spearman")
+        )
+
+    return [
+        ("load", load),
+        ("data_table", data_table),
+        ("table_page_sorted", table_page_sorted),
+        ("one_variable", one_variable),
+        ("two_variable", two_variable),
+        ("longitudinal", longitudinal),
+        ("correlation", correlation),
+    ]
+
+
+# all stages of one dataset in one mode, repeated
+# the first run is cold (nothing cached), the following runs are warm
+def _run_mode(app, mode, dataset, csv_bytes, repeat):
+    from datastore import content_hash, ingest_report
+
+    qualitative = ["item_{:02d}".format(i + 1) for i in range(dataset["categorical"])]
+    stages = (_direct_stages if mode == "direct" else _http_stages)(app, csv_bytes, qualitative)
+
+    runs = {name: [] for name, _ in stages}
+    for _ in range(repeat):
+        for name, fn in stages:
+            runs[name].append(_measure(fn))
+
+    results = []
+    for name, _ in stages:
+        seconds = [run["seconds"] for run in runs[name]]
+        results.append({
+            "dataset": dataset,
+            "mode": mode,
+            "stage": name,
+            "cold_seconds": seconds[0],
+            "warm_seconds": statistics.median(seconds[1:]) if len(seconds) > 1 else None,
+            "peak_bytes": max(run["peak_bytes"] for run in runs[name]),
+            "payload_bytes": runs[name][0]["payload_bytes"],
+            "runs": runs[name],
+        })
+        # encoding, engine and parse throughput of the cold load
+        if name == "load":
+            results[-1]["ingest"] = ingest_report(content_hash(csv_bytes))
+        print("{:>8} rows {:>6} {:<18} cold {:8.3f}s  warm {}  peak {:7.1f} MB  payload {:7.1f} KB".format(
+            dataset["rows"], mode, name, seconds[0],
+            "{:8.3f}s".format(results[-1]["warm_seconds"]) if results[-1]["warm_seconds"] is not None else "       -",
+            results[-1]["peak_bytes"] / 1024 ** 2,
+            results[-1]["payload_bytes"] / 1024,
+        ))
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd = ROOT, stderr = subprocess.DEVNULL, text = True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    import dash
+    import numpy
+    import pandas
+    import plotly
+    return {
+        "python": platform.python_version(),
+        "dash": dash.__version__,
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "plotly": plotly.__version__,
+    }
+
+
+def _result_key(result):
+    return (result["dataset"]["rows"], result["mode"], result["stage"])
+
+
+# print ratio of times to previous report (> 1 is slower)
+def _compare(report, baseline_path):
+    with open(baseline_path, encoding = "utf-8") as f:
+        baseline = {_result_key(r): r for r in json.load(f)["results"]}
+
+    print("\ncompared with {}".format(baseline_path))
+    for result in report["results"]:
+        previous = baseline.get(_result_key(result))
+        if previous is None:
+            continue
+        ratios = []
+        for name in ("cold_seconds", "warm_seconds"):
+            if result[name] and previous[name]:
+                ratios.append("{} x{:.2f}".format(name.split("_")[0], result[name] / previous[name]))
+        print("{:>8} rows {:>6} {:<18} {}".format(*_result_key(result), "  ".join(ratios)))
+
+
+def main():
+    args = _parse_args()
+    app = _load_app()
+    tracemalloc.start()
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec = "seconds"),
+        "revision": _git_revision(),
+        "versions": _versions(),
+        "config": vars(args),
+        "results": [],
+    }
+
+    for rows in args.rows:
+        for i, mode in enumerate(args.modes):
+            # another seed per mode, so that each mode starts with a dataset
+            # not cached by the other one
+            dataset = {
+                "rows": rows,
+                "numeric": args.numeric,
+                "categorical": args.categorical,
+                "nan_ratio": args.nan_ratio,
+                "seed": args.seed + i,
+            }
+            csv_bytes = synthetic_csv(rows, args.numeric, args.categorical, args.nan_ratio, dataset["seed"])
+            report["results"].extend(_run_mode(app, mode, dataset, csv_bytes, args.repeat))
+
+    tracemalloc.stop()
+
+    with open(args.output, "w", encoding = "utf-8") as f:
+        json.dump(report, f, ensure_ascii = False, indent = 2)
+    print("\nreport written to {}".format(args.output))
+
+    if args.compare:
+        _compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# synthetic clinical datasets for benchmarks
+# one row per visit of a patient: a time column, numeric lab values and
+# categorical items, with missing values at the given ratio. the same
+# arguments (and seed) always give the same bytes.
+import io
+
+import numpy as np
+import pandas as pd
+
+# values of categorical columns (cycled over columns)
+CATEGORY_VALUES = [
+    ["男", "女"],
+    ["A", "B", "O", "AB"],
+    ["なし", "軽度", "中等度", "重度"],
+    ["外来", "入院", "救急"],
+    ["陰性", "陽性"],
+]
+
+
+# DataFrame of synthetic visits
+def synthetic_frame(rows, numeric = 10, categorical = 5, nan_ratio = 0.05, seed = 0):
+    rng = np.random.default_rng(seed)
+    columns = {}
+
+    # time column: visit dates in increasing order
+    days = np.sort(rng.integers(0, 5 * 365, rows))
+    columns["visit_date"] = (
+        pd.Timestamp("2015-01-01") + pd.to_timedelta(days, unit = "D")
+    ).strftime("%Y-%m-%d")
+
+    for i in range(numeric):
+        # lab values around different scales, some skewed
+        center = 10.0 ** rng.uniform(0, 3)
+        values = rng.normal(center, center * 0.2, rows)
+        if i % 3 == 2:
+            values = rng.lognormal(np.log(center), 0.5, rows)
+        values = np.round(values, 2)
+        values[rng.random(rows) < nan_ratio] = np.nan
+        columns["lab_{:02d}".format(i + 1)] = values
+
+    for i in range(categorical):
+        choices = np.array(CATEGORY_VALUES[i % len(CATEGORY_VALUES)], dtype = object)
+        values = choices[rng.integers(0, len(choices), rows)]
+        values[rng.random(rows) < nan_ratio] = None
+        columns["item_{:02d}".format(i + 1)] = values
+
+    return pd.DataFrame(columns)
+
+
+# CSV bytes of synthetic visits (as uploaded by users)
+def synthetic_csv(rows, numeric = 10, categorical = 5, nan_ratio = 0.05, seed = 0):
+    buffer = io.StringIO()
+    synthetic_frame(rows, numeric, categorical, nan_ratio, seed).to_csv(buffer, index = False)
+    return buffer.getvalue().encode("utf-8")
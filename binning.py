@@ -0,0 +1,110 @@
+# server-side histogram binning
+# only bin edges and counts are sent to the browser instead of every raw
+# value. numeric columns are binned together: each value gets a bin index
+# offset by its column, and one bincount counts all columns at once.
+import os
+
+import numpy as np
+import pandas as pd
+
+from datastore import derived_result
+from descriptive import column_block_size, describe_dataset
+from executor import map_ordered
+
+# bin rule of numeric histograms: "fixed", "fd" (Freedman–Diaconis) or "sturges"
+HISTOGRAM_BIN_RULE = os.environ.get("MEDISIGHT_HIST_BIN_RULE", "fixed")
+
+# number of bins of the fixed rule
+HISTOGRAM_NBINS = int(os.environ.get("MEDISIGHT_HIST_NBINS", 24))
+
+# upper limit of bins of the data-dependent rules
+MAX_NBINS = 200
+
+
+# range and number of bins of each column from its statistics
+def _bin_layout(describe, rule, nbins):
+    count = describe["count"].to_numpy(dtype = float)
+    low = describe["min"].to_numpy(dtype = float)
+    high = describe["max"].to_numpy(dtype = float)
+
+    # same as np.histogram when all values are equal
+    same = ~(high > low)
+    low = np.where(same, low - 0.5, low)
+    high = np.where(same, high + 0.5, high)
+
+    if rule == "fd":
+        iqr = describe["q75"].to_numpy(dtype = float) - describe["q25"].to_numpy(dtype = float)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            width = 2.0 * iqr / np.cbrt(count)
+            k = np.ceil((high - low) / width)
+        k = np.where(np.isfinite(k) & (k >= 1), k, 1)
+    elif rule == "sturges":
+        k = np.ceil(np.log2(np.maximum(count, 1)) + 1)
+    else:
+        k = np.full(count.shape, nbins)
+
+    k = np.clip(k, 1, MAX_NBINS).astype(np.intp)
+    return low, high, k
+
+
+# histograms of all numeric columns of DataFrame
+# return {column: (edges, counts)}
+def numeric_histograms(df, describe, rule = HISTOGRAM_BIN_RULE, nbins = HISTOGRAM_NBINS):
+    columns = [col for col in describe.index if describe.loc[col, "count"] > 0]
+    if not columns:
+        return {}
+
+    low, high, k = _bin_layout(describe.loc[columns], rule, nbins)
+    offsets = np.concatenate([[0], np.cumsum(k)])
+
+    # blocks of columns are counted in parallel threads
+    block_size = column_block_size(len(df), len(columns))
+
+    def count_block(start):
+        stop = start + block_size
+        values = df[columns[start:stop]].to_numpy(dtype = np.float64, na_value = np.nan)
+        valid = ~np.isnan(values)
+
+        # bin index of each value, the last bin includes its right edge
+        scale = k[start:stop] / (high[start:stop] - low[start:stop])
+        with np.errstate(invalid = "ignore"):
+            index = np.floor((values - low[start:stop]) * scale)
+        index = np.clip(np.nan_to_num(index), 0, k[start:stop] - 1).astype(np.intp)
+
+        flat = (index + offsets[start:stop][np.newaxis, :])[valid]
+        return np.bincount(flat, minlength = offsets[-1])
+
+    counts = np.sum(
+        map_ordered(count_block, range(0, len(columns), block_size), pool = "kernels"),
+        axis = 0,
+    )
+
+    return {
+        col: (
+            np.linspace(low[i], high[i], k[i] + 1),
+            counts[offsets[i]:offsets[i + 1]],
+        )
+        for i, col in enumerate(columns)
+    }
+
+
+# histogram of qualitative column (one bar per value)
+# return (values, counts)
+def categorical_histogram(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = series.cat.categories
+    else:
+        codes, labels = pd.factorize(series, sort = True)
+    counts = np.bincount(codes[codes >= 0], minlength = len(labels))
+    return np.asarray(labels), counts
+
+
+# histograms of all numeric columns of dataset, computed once per rule
+def histogram_dataset(dataset_id, df, rule = HISTOGRAM_BIN_RULE, nbins = HISTOGRAM_NBINS):
+    return derived_result(
+        dataset_id,
+        ("histograms", rule, nbins),
+        lambda: numeric_histograms(df, describe_dataset(dataset_id, df), rule, nbins),
+        keep = True,
+    )
@@ -0,0 +1,236 @@
+# columnar on-disk dataset cache
+# each parsed dataset is written once as one .npy file per column
+# (strings as categorical codes + categories, nullable integers, floats and
+# booleans as values + mask, timezone-aware timestamps as UTC + their zone),
+# and opened with memory mapping. gunicorn workers share the same pages
+# instead of parsing their own copy of the CSV. small results derived from
+# a dataset (statistics, reports, ...) are pickled next to its columns,
+# under keys of the cache version.
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from version import CACHE_VERSION
+
+# directory of cached datasets (shared by gunicorn workers)
+CACHE_DIR = os.environ.get(
+    "MEDISIGHT_DATA_DIR",
+    os.path.join(tempfile.gettempdir(), "medisight-datasets"),
+)
+
+# disk budget of cached datasets (bytes)
+DISK_BUDGET_BYTES = int(os.environ.get("MEDISIGHT_DISK_CACHE_BYTES", 20 * 1024 ** 3))
+
+META_FILENAME = "meta.json"
+
+
+# dataset ids are sha256 hex digests (ids from the browser are checked
+# before they become paths)
+_dataset_id_pattern = re.compile(r"^[0-9a-f]{64}$")
+
+# nullable extension arrays stored as values + mask
+_masked_arrays = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+# directory of dataset id (None if id is invalid)
+def _dataset_dir(dataset_id):
+    if not isinstance(dataset_id, str) or not _dataset_id_pattern.match(dataset_id):
+        return None
+    return os.path.join(CACHE_DIR, dataset_id)
+
+
+# name of time zone, or None for zones only known by their offset
+def _tz_name(tz):
+    name = getattr(tz, "zone", None) or getattr(tz, "key", None)
+    if name:
+        return name
+    return "UTC" if str(tz) == "UTC" else None
+
+
+# time zone of column written by write_columnar
+def _column_tz(column):
+    if column["tz"]:
+        return column["tz"]
+    return datetime.timezone(datetime.timedelta(minutes = column["offset_minutes"]))
+
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+    )
+
+
+# remove least recently used datasets over the disk budget
+def _prune():
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        # skip datasets still being written
+        if "." in name:
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            entries.append((os.path.getmtime(path), _dir_size(path), path))
+        except OSError:
+            pass
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries)[:-1]:
+        if total <= DISK_BUDGET_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors = True)
+        total -= size
+
+
+# write DataFrame as one .npy per column
+def write_columnar(df, dataset_id):
+    path = _dataset_dir(dataset_id)
+    if path is None:
+        raise ValueError("invalid dataset id")
+    if os.path.exists(path):
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok = True)
+    tmp_path = tempfile.mkdtemp(prefix = dataset_id + ".", dir = CACHE_DIR)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        filename = "{}.npy".format(i)
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+            np.save(os.path.join(tmp_path, filename), series.to_numpy())
+            columns.append({"name": col, "kind": "array", "file": filename})
+        elif isinstance(series.dtype, pd.DatetimeTZDtype):
+            # UTC timestamps, shown in their zone again when read
+            tz = series.dt.tz
+            utc = series.dt.tz_convert("UTC").dt.tz_localize(None)
+            np.save(os.path.join(tmp_path, filename), utc.to_numpy())
+            columns.append({
+                "name": col,
+                "kind": "datetimetz",
+                "file": filename,
+                "tz": _tz_name(tz),
+                "offset_minutes": pd.Timestamp(0, tz = tz).utcoffset() // datetime.timedelta(minutes = 1),
+            })
+        elif isinstance(series.array, _masked_arrays):
+            mask_filename = "{}.mask.npy".format(i)
+            np.save(
+                os.path.join(tmp_path, filename),
+                series.to_numpy(dtype = series.dtype.numpy_dtype, na_value = 0),
+            )
+            np.save(os.path.join(tmp_path, mask_filename), series.isna().to_numpy())
+            columns.append({
+                "name": col,
+                "kind": "masked",
+                "file": filename,
+                "mask": mask_filename,
+                "dtype": str(series.dtype),
+            })
+        else:
+            categorical = pd.Categorical(series)
+            np.save(os.path.join(tmp_path, filename), categorical.codes)
+            columns.append({
+                "name": col,
+                "kind": "categorical",
+                "file": filename,
+                "categories": categorical.categories.tolist(),
+            })
+
+    with open(os.path.join(tmp_path, META_FILENAME), "w", encoding = "utf-8") as f:
+        json.dump(
+            {"n_rows": len(df), "columns": columns},
+            f,
+            ensure_ascii = False,
+            default = str,
+        )
+
+    # another worker may have written the same dataset meanwhile
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors = True)
+
+    _prune()
+
+
+# open cached dataset with memory mapping (None if not cached)
+def read_columnar(dataset_id):
+    path = _dataset_dir(dataset_id)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, META_FILENAME), encoding = "utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    data = {}
+    for column in meta["columns"]:
+        array = np.load(os.path.join(path, column["file"]), mmap_mode = "r")
+        if column["kind"] == "categorical":
+            data[column["name"]] = pd.Categorical.from_codes(
+                array,
+                categories = column["categories"],
+            )
+        elif column["kind"] == "datetimetz":
+            data[column["name"]] = pd.DatetimeIndex(array).tz_localize("UTC").tz_convert(_column_tz(column)).array
+        elif column["kind"] == "masked":
+            mask = np.load(os.path.join(path, column["mask"]), mmap_mode = "r")
+            array_type = pd.api.types.pandas_dtype(column["dtype"]).construct_array_type()
+            data[column["name"]] = array_type(array, mask)
+        else:
+            data[column["name"]] = array
+
+    # mark as recently used for pruning
+    os.utime(path)
+
+    # copy = False keeps each column as its own memory-mapped block
+    return pd.DataFrame(
+        data,
+        index = pd.RangeIndex(meta["n_rows"]),
+        columns = [column["name"] for column in meta["columns"]],
+        copy = False,
+    )
+
+
+# file of result derived under key (of this cache version only)
+def _derived_path(path, key):
+    name = hashlib.sha256(repr((CACHE_VERSION, key)).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(path, "derived-{}.pkl".format(name))
+
+
+# result derived from cached dataset under key (None if not kept, or if
+# it cannot be read)
+def read_derived(dataset_id, key):
+    path = _dataset_dir(dataset_id)
+    if path is None:
+        return None
+    try:
+        with open(_derived_path(path, key), "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # truncated file, or pickled by incompatible versions of pandas or
+        # numpy (AttributeError, ModuleNotFoundError, TypeError, ...)
+        return None
+
+
+# keep result derived from cached dataset under key, one file per key
+# (nothing if the dataset is not cached)
+def write_derived(dataset_id, key, result):
+    path = _dataset_dir(dataset_id)
+    if path is None or not os.path.isdir(path):
+        return
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir = path, suffix = ".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _derived_path(path, key))
+    except OSError:
+        pass
@@ -0,0 +1,254 @@
+# compact dtypes at load time
+# read_csv makes int64/float64/object columns. this profiling pass
+# downcasts integers, stores floats as float32 when every value is the
+# shortest decimal of its float32 (36.6, not 1234567.89), parses columns of
+# year-month-day dates, and converts repeated strings to categoricals.
+# the memory saved per column is reported (logged, and kept with the dataset).
+# display_values and display_dates give back values as uploaded for tables.
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# number of values checked at once before converting a column to float32
+FLOAT32_BLOCK_SIZE = 64 * 1024
+
+# decimal digits that float32 always keeps
+FLOAT32_DIGITS = 6
+
+# largest power of ten exactly represented as float64
+EXACT_POWER_OF_TEN = 22
+
+# strings with unique values up to this ratio of rows become categorical
+CATEGORY_MAX_RATIO = 0.5
+
+# number of values checked before parsing a column as dates
+DATE_SAMPLE_SIZE = 100
+
+# year-month-day with optional time (2024-01-31, 2024/1/31 08:30:00, ...)
+_date_pattern = re.compile(
+    r"^\d{4}([-/.])\d{1,2}\1\d{1,2}"
+    r"(?:([ T])\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$"
+)
+
+
+# columns of strings only (not of dates or other objects)
+def _is_string_column(series):
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna = True) == "string"
+
+
+# format of date string (None if it is not a year-month-day date)
+def _date_format(value):
+    match = _date_pattern.match(value.strip())
+    if match is None:
+        return None
+    sep, time_sep, seconds, fraction = match.groups()
+    date_format = "%Y{0}%m{0}%d".format(sep)
+    if time_sep:
+        date_format += time_sep + "%H:%M"
+        if seconds:
+            date_format += ":%S"
+            if fraction:
+                date_format += ".%f"
+    return date_format
+
+
+# format of the dates of column, if all sampled values are dates of one format
+def _sample_date_format(series):
+    sample = series.dropna().head(DATE_SAMPLE_SIZE).astype(str)
+    formats = set(sample.map(_date_format))
+    if sample.empty or len(formats) != 1 or None in formats:
+        return None
+    return formats.pop()
+
+
+# dates of column parsed with date_format (detected on a sample if None),
+# None unless all values parse
+def _parse_dates(series, date_format = None):
+    date_format = date_format or _sample_date_format(series)
+    if date_format is None:
+        return None
+
+    dates = pd.to_datetime(series.str.strip(), format = date_format, errors = "coerce")
+    if dates.isna().sum() != series.isna().sum():
+        return None
+    return dates
+
+
+# whether float64 values keep their shortest decimal as float32
+# (NaN equal to NaN): decimals of up to FLOAT32_DIGITS significant digits
+# always do, the others are compared with display_values of their float32
+def _float32_exact(values, converted):
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        exponent = _decimal_exponent(values)
+        short = _round_significant(values, FLOAT32_DIGITS, exponent) == values
+    rest = np.flatnonzero(~(short | np.isnan(values) | (values == 0)))
+    return bool((display_values(converted[rest]) == values[rest]).all())
+
+
+# float32 version of float64 values (None unless every value keeps its
+# shortest decimal), checked block by block: a column is rejected at its
+# first inexact block, and no temporary array is as large as the column
+def _float32_values(values):
+    converted = np.empty(len(values), dtype = np.float32)
+    for start in range(0, len(values), FLOAT32_BLOCK_SIZE):
+        block = values[start:start + FLOAT32_BLOCK_SIZE]
+        finite = block[np.isfinite(block)]
+        if finite.size and np.abs(finite).max() >= np.finfo(np.float32).max:
+            return None
+        converted[start:start + FLOAT32_BLOCK_SIZE] = block
+        if not _float32_exact(block, converted[start:start + FLOAT32_BLOCK_SIZE]):
+            return None
+    return converted
+
+
+# compact version of one column
+def compact_column(series):
+    kind = series.dtype.kind
+
+    if kind in "iu":
+        return pd.to_numeric(series, downcast = "integer" if series.min() < 0 else "unsigned")
+
+    if kind == "f" and series.dtype.itemsize > 4:
+        converted = _float32_values(series.to_numpy())
+        if converted is not None:
+            return pd.Series(converted, index = series.index, name = series.name)
+        return series
+
+    if _is_string_column(series):
+        dates = _parse_dates(series)
+        if dates is not None:
+            return dates
+        if series.nunique(dropna = True) <= CATEGORY_MAX_RATIO * max(len(series), 1):
+            return series.astype("category")
+
+    return series
+
+
+# compact all columns of DataFrame
+# date_formats: formats of columns already parsed as dates ({column: format},
+# kept in the report as the formats of columns parsed here)
+# return compacted DataFrame and report of memory (and date format) per column
+def compact_frame(df, date_formats = None):
+    date_formats = date_formats or {}
+    columns = {}
+    report = []
+    for col in df.columns:
+        before = df[col]
+        after = compact_column(before)
+        columns[col] = after
+        before_bytes = int(before.memory_usage(index = False, deep = True))
+        after_bytes = int(after.memory_usage(index = False, deep = True))
+        date_format = date_formats.get(col)
+        if after.dtype.kind == "M" and _is_string_column(before):
+            date_format = _sample_date_format(before)
+        report.append({
+            "column": col,
+            "dtype_before": str(before.dtype),
+            "dtype_after": str(after.dtype),
+            "bytes_before": before_bytes,
+            "bytes_after": after_bytes,
+            "bytes_saved": before_bytes - after_bytes,
+            "date_format": date_format,
+        })
+
+    compacted = pd.DataFrame(columns, index = df.index)
+    report = pd.DataFrame(report)
+    for row in report.itertuples():
+        logger.info(
+            "compacted column %r: %s -> %s, %d -> %d bytes",
+            row.column, row.dtype_before, row.dtype_after, row.bytes_before, row.bytes_after,
+        )
+    logger.info(
+        "compacted %d columns: %d -> %d bytes",
+        len(report),
+        report["bytes_before"].sum() if len(report) else 0,
+        report["bytes_after"].sum() if len(report) else 0,
+    )
+    return compacted, report
+
+
+# power of ten of the first significant digit of values
+def _decimal_exponent(values):
+    return np.floor(np.log10(np.abs(values))).astype(np.int64)
+
+
+# values rounded to digits significant digits (NaN where the power of ten
+# it takes is not exact as float64)
+def _round_significant(values, digits, exponent):
+    shift = digits - 1 - exponent
+    scale = 10.0 ** np.minimum(np.abs(shift), EXACT_POWER_OF_TEN)
+    rounded = np.where(shift >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    return np.where(np.abs(shift) <= EXACT_POWER_OF_TEN, rounded, np.nan)
+
+
+# float32 values as float64 with their shortest decimal (36.6, not
+# 36.599998...) for tables shown to users
+# values are rounded to 1, 2, ... significant digits until they give back
+# their float32; values out of the range of exact powers of ten are
+# converted through their decimal string
+def display_values(values):
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        return values
+
+    wide = values.astype(np.float64)
+    result = wide.copy()
+    todo = np.flatnonzero(np.isfinite(wide) & (wide != 0))
+    exponent = _decimal_exponent(wide[todo])
+    # 1 to 9 significant digits need powers of ten up to 10 ** (8 - exponent)
+    exact = (exponent <= EXACT_POWER_OF_TEN) & (exponent >= 8 - EXACT_POWER_OF_TEN)
+    rest, todo, exponent = todo[~exact], todo[exact], exponent[exact]
+    for digits in range(1, 10):
+        if todo.size == 0:
+            break
+        with np.errstate(invalid = "ignore", over = "ignore"):
+            rounded = _round_significant(wide[todo], digits, exponent)
+            found = rounded.astype(np.float32) == values[todo]
+        result[todo[found]] = rounded[found]
+        todo, exponent = todo[~found], exponent[~found]
+    rest = np.concatenate([rest, todo])
+    if rest.size:
+        result[rest] = values[rest].astype(str).astype(np.float64)
+    return result
+
+
+# base and new rows with the same dtypes, to be concatenated and compacted
+# again: float32 columns of base are widened with their shortest decimal,
+# and strings of new rows in date columns of base are parsed as dates
+# (with the format of the base column from date_formats, when known)
+# raise ValueError if new rows are not dates where base has dates
+def align_frames(base, rows, date_formats = None):
+    date_formats = date_formats or {}
+    base_columns, row_columns = {}, {}
+    for col in base.columns:
+        left, right = base[col], rows[col]
+        if left.dtype == np.float32:
+            left = pd.Series(display_values(left.to_numpy()), index = left.index, name = col)
+        if right.dtype == np.float32:
+            right = pd.Series(display_values(right.to_numpy()), index = right.index, name = col)
+        if left.dtype.kind == "M" and right.dtype.kind != "M":
+            dates = None
+            if right.isna().all():
+                dates = pd.to_datetime(right)
+            elif _is_string_column(right):
+                dates = _parse_dates(right, date_formats.get(col))
+                if dates is None:
+                    dates = _parse_dates(right)
+            if dates is None:
+                raise ValueError("values of column {!r} are not dates".format(col))
+            right = dates
+        base_columns[col], row_columns[col] = left, right
+    return pd.DataFrame(base_columns, index = base.index), pd.DataFrame(row_columns, index = rows.index)
+
+
+# dates as strings for tables shown to users, in the format they were
+# uploaded in (date_format), or year-month-day with the time if any
+def display_dates(series, date_format = None):
+    if date_format is None:
+        dates = series.dropna()
+        date_format = "%Y-%m-%d" if (dates == dates.dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+    return series.dt.strftime(date_format)
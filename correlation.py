@@ -0,0 +1,85 @@
+# correlation matrices of quantitative columns
+# Pearson correlations of all numeric column pairs come from four matrix
+# products (pair counts, sums, sums of squares and cross products) over
+# blocks of rows, so missing values are skipped per pair without looping
+# over pairs. Spearman runs the same kernel on the ranks of each column,
+# which are derived from its cached sort order.
+import numpy as np
+import pandas as pd
+
+from datastore import derived_result
+from descriptive import BLOCK_BYTES, describe_dataset
+from executor import map_ordered
+from sort_index import column_ranks
+
+# methods of correlation matrices
+METHODS = ("pearson", "spearman")
+
+
+# rows of one block: values, mask and their products within BLOCK_BYTES
+def _rows_per_block(n_cols):
+    return max(1, BLOCK_BYTES // (8 * 3 * max(n_cols, 1)))
+
+
+# correlations of all pairs of columns of rows block(start, stop)
+# (values shifted by center per column to keep the sums small)
+def _pairwise_correlation(block, n_rows, center):
+    n_cols = len(center)
+    if n_rows == 0 or n_cols == 0:
+        return np.full((n_cols, n_cols), np.nan)
+
+    step = _rows_per_block(n_cols)
+
+    # blocks of rows are summed in parallel threads
+    def block_sums(start):
+        values = block(start, start + step) - center
+        valid = ~np.isnan(values)
+        mask = valid.astype(np.float64)
+        x = np.where(valid, values, 0.0)
+        # [i, j] over rows where both column i and column j are valid
+        return np.stack([mask.T @ mask, x.T @ mask, (x * x).T @ mask, x.T @ x])
+
+    n, sx, sxx, sxy = np.sum(
+        map_ordered(block_sums, range(0, n_rows, step), pool = "kernels"),
+        axis = 0,
+    )
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        cov = sxy - sx * sx.T / n
+        var = sxx - sx * sx / n
+        r = np.clip(cov / np.sqrt(var * var.T), -1.0, 1.0)
+    r[n < 2] = np.nan
+    return r
+
+
+# correlation matrix of all numeric columns of dataset
+# (index and columns: column names)
+def correlation_matrix(dataset_id, df, method = "pearson"):
+    describe = describe_dataset(dataset_id, df)
+    columns = list(describe.index)
+
+    if method == "spearman":
+        ranks = [column_ranks(dataset_id, df, col) for col in columns]
+        center = (describe["count"].to_numpy(dtype = float) + 1.0) / 2.0
+
+        def block(start, stop):
+            return np.column_stack([r[start:stop] for r in ranks])
+    else:
+        numeric = df[columns]
+        center = np.nan_to_num(describe["mean"].to_numpy(dtype = float))
+
+        def block(start, stop):
+            return numeric.iloc[start:stop].to_numpy(dtype = np.float64, na_value = np.nan)
+
+    r = _pairwise_correlation(block, len(df), np.nan_to_num(center))
+    return pd.DataFrame(r, index = columns, columns = columns)
+
+
+# correlation matrix of dataset, computed once per method
+def correlation_dataset(dataset_id, df, method = "pearson"):
+    return derived_result(
+        dataset_id,
+        ("correlation", method),
+        lambda: correlation_matrix(dataset_id, df, method),
+        keep = True,
+    )
@@ -0,0 +1,249 @@
+# server-side dataset store
+# uploaded files are parsed once and kept here under a dataset id,
+# so callbacks only exchange the id with the browser.
+# the dataset id is the hash of the uploaded bytes, so the same export
+# uploaded again (by anyone) is served from the cache without parsing.
+# parsed datasets are also written to the columnar on-disk cache, which
+# other gunicorn workers open with memory mapping, together with the
+# results kept with them (reports of the parse, ...).
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from columnar import read_columnar, read_derived, write_columnar, write_derived
+from compact import align_frames, compact_frame
+from ingest import read_table_file
+from timing import timed
+
+# memory budget of the cache (bytes, measured by memory_usage(deep=True))
+CACHE_BUDGET_BYTES = int(os.environ.get("MEDISIGHT_CACHE_BYTES", 2 * 1024 ** 3))
+
+# size of blocks read from uploaded files
+BLOCK_SIZE = 1024 * 1024
+
+# dataset id -> (DataFrame, nbytes), least recently used first
+_datasets = OrderedDict()
+_lock = threading.Lock()
+_counters = {
+    "hits": 0,
+    "misses": 0,
+    "disk_hits": 0,
+    "evictions": 0,
+}
+_total_bytes = 0
+
+# dataset id -> {key: result derived from the dataset}
+_derived = {}
+
+
+# hash of bytes (dataset id of appended rows and selected columns)
+def content_hash(decoded):
+    return hashlib.sha256(decoded).hexdigest()
+
+
+# dataset id of the uploaded file, hashed block by block
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# dataset id of the selected columns of uploaded file
+def _projected_id(dataset_id, columns):
+    if not columns:
+        return dataset_id
+    return content_hash("\n".join([dataset_id] + list(columns)).encode("utf-8"))
+
+
+# parse file on disk into DataFrame (no intermediate bytes or str copy)
+# return DataFrame and report of parse
+def parse_file(path, filename = "", columns = None):
+    return read_table_file(path, filename, columns)
+
+
+# drop least recently used datasets until the budget fits
+# (the most recent one is kept even if it alone is over budget)
+def _evict():
+    global _total_bytes
+    while _total_bytes > CACHE_BUDGET_BYTES and len(_datasets) > 1:
+        dataset_id, (_, nbytes) = _datasets.popitem(last = False)
+        _derived.pop(dataset_id, None)
+        _total_bytes -= nbytes
+        _counters["evictions"] += 1
+
+
+# keep DataFrame in memory under dataset id
+def _keep(df, dataset_id):
+    global _total_bytes
+    nbytes = int(df.memory_usage(deep = True).sum())
+    with _lock:
+        if dataset_id in _datasets:
+            _total_bytes -= _datasets.pop(dataset_id)[1]
+        _datasets[dataset_id] = (df, nbytes)
+        _total_bytes += nbytes
+        _evict()
+    return df
+
+
+# write parsed DataFrame to the columnar cache and keep its
+# memory-mapped version under dataset id (returned)
+def register_dataset(df, dataset_id):
+    write_columnar(df, dataset_id)
+    mapped = read_columnar(dataset_id)
+    return _keep(df if mapped is None else mapped, dataset_id)
+
+
+# DataFrame of dataset id from memory or the columnar cache
+# (None if not cached anywhere)
+def _find(dataset_id):
+    with _lock:
+        entry = _datasets.get(dataset_id)
+        if entry is not None:
+            _datasets.move_to_end(dataset_id)
+            return entry[0], "hits"
+
+    df = read_columnar(dataset_id)
+    if df is None:
+        return None, "misses"
+    return _keep(df, dataset_id), "disk_hits"
+
+
+# cached DataFrame of dataset id, counted as hit or miss
+def _lookup(dataset_id):
+    df, counter = _find(dataset_id)
+    with _lock:
+        _counters[counter] += 1
+    return df
+
+
+# compact dtypes of parsed DataFrame and register it
+# (the reports of parse and memory saved per column are kept with the dataset)
+# date_formats: formats of columns already parsed as dates
+def _register_parsed(df, ingest, dataset_id, date_formats = None):
+    with timed("compact"):
+        df, report = compact_frame(df, date_formats)
+    with timed("columnar"):
+        df = register_dataset(df, dataset_id)
+    keep_derived(dataset_id, {
+        "ingest-report": ingest,
+        "compaction-report": report,
+    })
+    return df
+
+
+# parse uploaded file on disk (or reuse the cached parse)
+# filename: name of the uploaded file (the format is detected from it when
+# the bytes do not tell)
+# columns: names of columns to read (all if None)
+# return dataset id and DataFrame
+def load_file(path, filename = "", columns = None):
+    with timed("hash"):
+        dataset_id = _projected_id(file_hash(path), columns)
+
+    df = _lookup(dataset_id)
+    if df is None:
+        with timed("parse"):
+            df, ingest = parse_file(path, filename, columns)
+        df = _register_parsed(df, ingest, dataset_id)
+    return dataset_id, df
+
+
+# formats of the date columns of dataset parsed from strings ({column: format})
+def date_formats(dataset_id):
+    report = compaction_report(dataset_id)
+    if report is None or "date_format" not in report:
+        return {}
+    return {row.column: row.date_format for row in report.itertuples() if row.date_format}
+
+
+# append rows of uploaded file to cached dataset base_id (or reuse the
+# cached append); the new rows must have the same columns, and get the dtypes
+# of the compacted base before both are compacted together
+# the dataset id is the hash of the base id and the uploaded file, so the
+# same rows appended again give the same dataset
+# return dataset id and DataFrame of all rows (base rows first)
+def append_file(base_id, path, filename = ""):
+    base = _lookup(base_id)
+    if base is None:
+        raise KeyError(base_id)
+    with timed("hash"):
+        dataset_id = content_hash((base_id + file_hash(path)).encode("utf-8"))
+
+    df = _lookup(dataset_id)
+    if df is None:
+        with timed("parse"):
+            rows, ingest = parse_file(path, filename)
+        if list(rows.columns) != list(base.columns):
+            raise ValueError("columns of appended rows differ from the dataset")
+        formats = date_formats(base_id)
+        with timed("append"):
+            df = pd.concat(list(align_frames(base, rows, formats)), ignore_index = True)
+        df = _register_parsed(df, ingest, dataset_id, formats)
+    return dataset_id, df
+
+
+# look up DataFrame by dataset id (None if unknown or evicted)
+def get_dataset(dataset_id):
+    if not dataset_id:
+        return None
+    return _find(dataset_id)[0]
+
+
+# result derived from dataset (stats, indexes, ...) computed once per key
+# and dropped together with the dataset
+# keep: small results are also kept with the columnar cache, so other
+# workers, background jobs and this worker after an eviction read them
+# instead of computing them again (results computed by a background job
+# are not lost with its process)
+def derived_result(dataset_id, key, compute, keep = False):
+    with _lock:
+        results = _derived.get(dataset_id, {})
+        if key in results:
+            return results[key]
+
+    result = read_derived(dataset_id, key) if keep else None
+    if result is None:
+        result = compute()
+        if keep and result is not None:
+            write_derived(dataset_id, key, result)
+    with _lock:
+        if dataset_id in _datasets:
+            _derived.setdefault(dataset_id, {})[key] = result
+    return result
+
+
+# keep results derived from dataset ({key: result}) in memory and with its
+# columnar cache, replacing results computed before
+def keep_derived(dataset_id, results):
+    for key, result in results.items():
+        write_derived(dataset_id, key, result)
+    with _lock:
+        if dataset_id in _datasets:
+            _derived.setdefault(dataset_id, {}).update(results)
+
+
+# encoding, engine and throughput (MB/s) of the parse of the dataset
+# (None if unknown)
+def ingest_report(dataset_id):
+    return derived_result(dataset_id, "ingest-report", lambda: None, keep = True)
+
+
+# memory saved per column when the dataset was parsed (None if unknown)
+def compaction_report(dataset_id):
+    return derived_result(dataset_id, "compaction-report", lambda: None, keep = True)
+
+
+# counters and size of the cache
+def cache_info():
+    with _lock:
+        return dict(
+            _counters,
+            entries = len(_datasets),
+            bytes = _total_bytes,
+            budget_bytes = CACHE_BUDGET_BYTES,
+        )
@@ -0,0 +1,176 @@
+# shape-preserving downsampling of longitudinal line charts
+# each series is reduced to a fixed number of points (min/max per bucket or
+# Largest-Triangle-Three-Buckets), so peaks and troughs stay visible while
+# the payload size does not depend on the number of timestamps.
+# zooming re-decimates only the visible range (numeric and datetime axes:
+# the range of a category axis counts only the categories drawn).
+import os
+
+import numpy as np
+import pandas as pd
+
+from datastore import derived_result
+
+# decimation method: "minmax" or "lttb"
+DECIMATE_METHOD = os.environ.get("MEDISIGHT_DECIMATE_METHOD", "minmax")
+
+# number of points of one line chart
+LINE_POINTS = int(os.environ.get("MEDISIGHT_LINE_POINTS", 2000))
+
+
+# indices of min and max of each bucket (plus first and last point)
+def minmax_indices(y, n_out):
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+
+    n_buckets = max(1, n_out // 2)
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+
+    base = np.arange(n_buckets) * size
+    lowest = np.where(np.isnan(padded), np.inf, padded).argmin(axis = 1) + base
+    highest = np.where(np.isnan(padded), -np.inf, padded).argmax(axis = 1) + base
+
+    indices = np.unique(np.concatenate([lowest, highest, [0, n - 1]]))
+    return indices[indices < n]
+
+
+# indices selected by Largest-Triangle-Three-Buckets
+def lttb_indices(x, y, n_out):
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    sizes = np.diff(edges)
+    average_x = np.add.reduceat(x[:n - 1], edges[:-1]) / sizes
+    average_y = np.add.reduceat(y[:n - 1], edges[:-1]) / sizes
+    # average of the next bucket (the last point for the last bucket)
+    next_x = np.append(average_x[1:], x[n - 1])
+    next_y = np.append(average_y[1:], y[n - 1])
+
+    selected = np.empty(n_out, dtype = np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (next_y[i] - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def decimate_indices(x, y, n_out, method = DECIMATE_METHOD):
+    if method == "lttb":
+        return lttb_indices(x, y, n_out)
+    return minmax_indices(y, n_out)
+
+
+# sorted x axis of longitudinal variable
+# kind: "numeric", "datetime" or "category"
+# x: numeric position of each sorted row (ns for datetime)
+# labels: values of each sorted row drawn on the axis
+def longitudinal_axis(df, x_col):
+    series = df[x_col]
+    if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        kind = "numeric"
+        x = series.to_numpy(dtype = np.float64, na_value = np.nan)
+    else:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            dates = series
+        else:
+            dates = pd.to_datetime(series.astype(str), errors = "coerce")
+        if dates.notna().sum() * 2 >= series.notna().sum() and dates.notna().any():
+            kind = "datetime"
+            x = dates.to_numpy(dtype = "datetime64[ns]").astype(np.int64).astype(np.float64)
+            x[dates.isna().to_numpy()] = np.nan
+        else:
+            kind = "category"
+            x = None
+
+    if kind == "category":
+        order = np.argsort(series.astype(str).to_numpy(), kind = "stable")
+        labels = series.to_numpy()[order]
+        # position of each value on the category axis
+        x = pd.factorize(labels)[0].astype(np.float64)
+    else:
+        order = np.argsort(x, kind = "stable")
+        x = x[order]
+        valid = ~np.isnan(x)
+        order, x = order[valid], x[valid]
+        if kind == "datetime":
+            labels = np.datetime_as_string(x.astype(np.int64).astype("datetime64[ns]"), unit = "ms")
+        else:
+            labels = x
+
+    return {
+        "kind": kind,
+        "order": order,
+        "x": x,
+        "labels": labels,
+    }
+
+
+# sorted x axis of dataset, computed once per longitudinal variable
+def longitudinal_axis_dataset(dataset_id, df, x_col):
+    return derived_result(
+        dataset_id,
+        ("longitudinal-axis", x_col),
+        lambda: longitudinal_axis(df, x_col),
+    )
+
+
+# x range of relayoutData of a graph
+# return (True, (low, high)) when zoomed, (True, None) when reset,
+# (False, None) when the x range did not change or the axis is a category axis
+# (its range indexes the drawn categories, not the positions in x)
+def zoom_range(relayout_data, axis):
+    if axis["kind"] == "category":
+        return False, None
+    relayout_data = relayout_data or {}
+    if relayout_data.get("xaxis.autorange"):
+        return True, None
+
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        low, high = relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    elif "xaxis.range" in relayout_data:
+        low, high = relayout_data["xaxis.range"]
+    else:
+        return False, None
+
+    if axis["kind"] == "datetime":
+        return True, (float(pd.Timestamp(low).value), float(pd.Timestamp(high).value))
+    return True, (float(low), float(high))
+
+
+# decimated (x, y) of one column within x range
+def line_points(axis, series, x_range = None, n_out = LINE_POINTS, method = DECIMATE_METHOD):
+    x = axis["x"]
+    start, stop = 0, len(x)
+    if x_range is not None:
+        # one more point on each side, so the line reaches the edges
+        start = max(np.searchsorted(x, x_range[0], side = "left") - 1, 0)
+        stop = min(np.searchsorted(x, x_range[1], side = "right") + 1, len(x))
+
+    rows = axis["order"][start:stop]
+    labels = axis["labels"][start:stop]
+    x = x[start:stop]
+
+    if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        y = series.to_numpy(dtype = np.float64, na_value = np.nan)[rows]
+        valid = ~np.isnan(y)
+        indices = np.flatnonzero(valid)[decimate_indices(x[valid], y[valid], n_out, method)]
+    else:
+        y = series.to_numpy()[rows]
+        # evenly spaced rows for non-numeric values
+        indices = np.unique(np.linspace(0, max(len(y) - 1, 0), min(n_out, len(y))).astype(np.intp))
+
+    return labels[indices], y[indices]
@@ -0,0 +1,97 @@
+# density (2-D binned) mode of two-variable plots
+# above a row threshold, pairs are aggregated on the server into a grid of
+# counts, so the figure size does not depend on the number of rows.
+# points in sparse cells are overlaid as a sample of outliers.
+import os
+
+import numpy as np
+import pandas as pd
+
+# rows above which scatter plots are drawn as density
+DENSITY_ROW_THRESHOLD = int(os.environ.get("MEDISIGHT_DENSITY_ROWS", 20000))
+
+# number of bins of each axis
+DENSITY_NBINS = 100
+
+# cells with this many points or less are treated as outliers
+OUTLIER_CELL_COUNT = 2
+
+# upper limit of outlier points drawn
+MAX_OUTLIER_POINTS = 2000
+
+OTHER_LABEL = "その他"
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype)
+
+
+# bin index of each row (-1 if missing) and labels of bins of one axis
+def _axis_bins(series, nbins):
+    if _is_numeric(series):
+        values = series.to_numpy(dtype = np.float64, na_value = np.nan)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return np.full(len(values), -1, dtype = np.intp), np.array([])
+        low, high = values[valid].min(), values[valid].max()
+        if not high > low:
+            low, high = low - 0.5, high + 0.5
+        with np.errstate(invalid = "ignore"):
+            index = np.floor((values - low) * (nbins / (high - low)))
+        index = np.clip(np.nan_to_num(index), 0, nbins - 1).astype(np.intp)
+        index[~valid] = -1
+        edges = np.linspace(low, high, nbins + 1)
+        return index, (edges[:-1] + edges[1:]) / 2
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy().astype(np.intp)
+        labels = np.asarray(series.cat.categories, dtype = object)
+    else:
+        codes, labels = pd.factorize(series, sort = True)
+        codes = codes.astype(np.intp)
+        labels = np.asarray(labels, dtype = object)
+
+    # keep the most frequent values and put the rest into one bin
+    if len(labels) > nbins:
+        frequency = np.bincount(codes[codes >= 0], minlength = len(labels))
+        keep = np.argsort(-frequency, kind = "stable")[:nbins - 1]
+        remap = np.full(len(labels), nbins - 1, dtype = np.intp)
+        remap[keep] = np.arange(nbins - 1)
+        codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+        labels = np.append(labels[keep], OTHER_LABEL)
+
+    return codes, labels
+
+
+# counts of (x, y) on a grid and a sample of points in sparse cells
+def density_grid(x_series, y_series, nbins = DENSITY_NBINS):
+    x_index, x_labels = _axis_bins(x_series, nbins)
+    y_index, y_labels = _axis_bins(y_series, nbins)
+    nx, ny = len(x_labels), len(y_labels)
+
+    valid = (x_index >= 0) & (y_index >= 0)
+    cell = y_index * nx + x_index
+    counts = np.bincount(cell[valid], minlength = nx * ny)
+
+    # points in sparse cells, sampled reproducibly
+    # (only when both axes are numeric, so points fall on the grid)
+    if not (_is_numeric(x_series) and _is_numeric(y_series)):
+        valid = np.zeros_like(valid)
+    sparse = valid.copy()
+    sparse[valid] = counts[cell[valid]] <= OUTLIER_CELL_COUNT
+    outliers = np.flatnonzero(sparse)
+    if len(outliers) > MAX_OUTLIER_POINTS:
+        rng = np.random.default_rng(0)
+        outliers = np.sort(rng.choice(outliers, MAX_OUTLIER_POINTS, replace = False))
+
+    z = counts.reshape(ny, nx).astype(float)
+    z[z == 0] = np.nan
+
+    return {
+        "x": x_labels,
+        "y": y_labels,
+        "z": z,
+        "outlier_x": x_series.iloc[outliers].to_numpy(),
+        "outlier_y": y_series.iloc[outliers].to_numpy(),
+    }
+
@@ -0,0 +1,147 @@
+# descriptive statistics of quantitative columns
+# all numeric columns are processed together as 2-D arrays: the moments
+# come from one fused pass and all quantiles, min, max and mode from one
+# sort. NaN values are skipped.
+import numpy as np
+import pandas as pd
+
+from compact import display_values
+from datastore import derived_result
+from executor import MAX_WORKERS, map_ordered
+
+# bytes of one block of columns converted to float64 at once
+BLOCK_BYTES = 256 * 1024 ** 2
+
+# columns of the result
+STATS_COLUMNS = [
+    "count", "mean", "median", "mode", "max", "min",
+    "std", "skew", "kurtosis", "q25", "q50", "q75",
+]
+
+
+# number of columns of one block: within BLOCK_BYTES as float64, and
+# small enough to give every kernel thread a block
+def column_block_size(n_rows, n_cols):
+    by_bytes = max(1, BLOCK_BYTES // (8 * max(n_rows, 1)))
+    by_workers = max(1, -(-n_cols // MAX_WORKERS))
+    return min(by_bytes, by_workers)
+
+
+# quantiles (linear interpolation as np.percentile) of sorted columns
+# whose valid values are the first count rows
+def _sorted_quantile(sorted_values, count, q):
+    position = q * np.maximum(count - 1, 0)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.ceil(position).astype(np.intp)
+    columns = np.arange(sorted_values.shape[1])
+    low_values = sorted_values[lower, columns]
+    high_values = sorted_values[upper, columns]
+    return low_values + (high_values - low_values) * (position - lower)
+
+
+# most frequent value (smallest one if tied) of sorted columns
+def _sorted_mode(sorted_values):
+    n_rows, n_cols = sorted_values.shape
+    flat = sorted_values.T.ravel()
+
+    # start of each run of equal values (NaN always starts a new run)
+    change = np.ones(flat.shape, dtype = bool)
+    change[1:] = flat[1:] != flat[:-1]
+    change[::n_rows] = True
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, flat.size))
+    valid = ~np.isnan(flat[starts])
+    starts, lengths = starts[valid], lengths[valid]
+    columns = starts // n_rows
+
+    # per column, the longest run first and then the smallest value
+    order = np.lexsort((starts, -lengths, columns))
+    columns = columns[order]
+    first = np.ones(columns.shape, dtype = bool)
+    first[1:] = columns[1:] != columns[:-1]
+
+    mode = np.full(n_cols, np.nan)
+    mode[columns[first]] = flat[starts[order][first]]
+    return mode
+
+
+# statistics of one block of columns as 2-D array (rows x columns)
+def _describe_block(values):
+    valid = ~np.isnan(values)
+    count = valid.sum(axis = 0)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        # moments
+        mean = np.where(valid, values, 0.0).sum(axis = 0) / count
+        deviation = np.where(valid, values - mean, 0.0)
+        deviation2 = deviation * deviation
+        m2 = deviation2.sum(axis = 0) / count
+        m3 = (deviation2 * deviation).sum(axis = 0) / count
+        m4 = (deviation2 * deviation2).sum(axis = 0) / count
+        std = np.sqrt(m2 * count / (count - 1))
+        skew = m3 / m2 ** 1.5
+        kurtosis = m4 / m2 ** 2 - 3.0
+
+        # order statistics from one sort (NaN sorted to the end)
+        sorted_values = np.sort(values, axis = 0)
+        q25 = _sorted_quantile(sorted_values, count, 0.25)
+        q50 = _sorted_quantile(sorted_values, count, 0.5)
+        q75 = _sorted_quantile(sorted_values, count, 0.75)
+        minimum = sorted_values[0]
+        maximum = sorted_values[np.maximum(count - 1, 0), np.arange(values.shape[1])]
+        mode = _sorted_mode(sorted_values)
+
+    empty = count == 0
+    for result in (mean, q25, q50, q75, minimum, maximum):
+        result[empty] = np.nan
+
+    return {
+        "count": count,
+        "mean": mean,
+        "median": q50,
+        "mode": mode,
+        "max": maximum,
+        "min": minimum,
+        "std": std,
+        "skew": skew,
+        "kurtosis": kurtosis,
+        "q25": q25,
+        "q50": q50,
+        "q75": q75,
+    }
+
+
+# values of numeric columns as 2-D float64 array (NaN for missing values,
+# float32 columns as their shortest decimal, as uploaded)
+def float_values(df):
+    values = df.to_numpy(dtype = np.float64, na_value = np.nan)
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == np.float32:
+            values[:, i] = display_values(df.iloc[:, i].to_numpy())
+    return values
+
+
+# statistics of all numeric columns of DataFrame
+# (index: column name, columns: STATS_COLUMNS)
+def describe_numeric(df):
+    numeric = df.select_dtypes(include = ["number", "bool"])
+    if numeric.shape[0] == 0 or numeric.shape[1] == 0:
+        return pd.DataFrame(columns = STATS_COLUMNS, index = numeric.columns, dtype = float)
+
+    # blocks of columns are described in parallel threads
+    block_size = column_block_size(numeric.shape[0], numeric.shape[1])
+
+    def describe_block(start):
+        values = float_values(numeric.iloc[:, start:start + block_size])
+        return pd.DataFrame(_describe_block(values), columns = STATS_COLUMNS)
+
+    blocks = map_ordered(describe_block, range(0, numeric.shape[1], block_size), pool = "kernels")
+
+    result = pd.concat(blocks, ignore_index = True)
+    result.index = numeric.columns
+    return result
+
+
+# statistics of dataset, computed once per dataset
+def describe_dataset(dataset_id, df):
+    return derived_result(dataset_id, "describe", lambda: describe_numeric(df), keep = True)
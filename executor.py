@@ -0,0 +1,86 @@
+# shared executors for parallel work
+# "kernels" is a thread pool for numpy work on blocks of columns (numpy
+# releases the GIL). "cards" builds figures and tables of cards, with
+# threads or processes (MEDISIGHT_EXECUTOR). kernels never submit more
+# work, so cards waiting on kernels cannot deadlock the pools.
+# each request runs at most REQUEST_CONCURRENCY tasks at once, so one user
+# cannot take every worker.
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# executor of cards: "thread" or "process"
+EXECUTOR_KIND = os.environ.get("MEDISIGHT_EXECUTOR", "thread")
+
+# workers of each pool
+MAX_WORKERS = int(os.environ.get("MEDISIGHT_MAX_WORKERS", os.cpu_count() or 1))
+
+# tasks of one request running at once
+REQUEST_CONCURRENCY = int(os.environ.get("MEDISIGHT_REQUEST_CONCURRENCY", 4))
+
+_executors = {}
+_lock = threading.Lock()
+
+
+# threads of pools do not exist in forked processes (background callbacks),
+# which create their own pools
+def _reset_after_fork():
+    global _lock
+    _executors.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child = _reset_after_fork)
+
+
+# executor of pool name ("kernels" or "cards"), created on first use
+def get_executor(pool):
+    with _lock:
+        if pool not in _executors:
+            if pool == "cards" and EXECUTOR_KIND == "process":
+                _executors[pool] = ProcessPoolExecutor(max_workers = MAX_WORKERS)
+            else:
+                _executors[pool] = ThreadPoolExecutor(
+                    max_workers = MAX_WORKERS,
+                    thread_name_prefix = "medisight-" + pool,
+                )
+        return _executors[pool]
+
+
+def _copy_result(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+# submit fn(item) for items, at most limit at once
+# return futures in the order of items
+def submit_ordered(fn, items, pool = "cards", limit = REQUEST_CONCURRENCY):
+    executor = get_executor(pool)
+    items = list(items)
+    results = [Future() for _ in items]
+    pending = iter(range(len(items)))
+    pending_lock = threading.Lock()
+
+    # the next item starts when one of the running items is done
+    def submit_next():
+        with pending_lock:
+            index = next(pending, None)
+        if index is None:
+            return
+        future = executor.submit(fn, items[index])
+
+        def done(future, index = index):
+            _copy_result(future, results[index])
+            submit_next()
+        future.add_done_callback(done)
+
+    for _ in range(min(max(limit, 1), len(items))):
+        submit_next()
+    return results
+
+
+# results of fn(item) for items computed in parallel, in the order of items
+def map_ordered(fn, items, pool = "cards", limit = REQUEST_CONCURRENCY):
+    return [future.result() for future in submit_ordered(fn, items, pool, limit)]
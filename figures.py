@@ -0,0 +1,136 @@
+# figure factory with the MediSight style
+# the style (white background, #AEAAAA axis lines, #2b4b78 traces) is
+# registered once as the plotly template "medisight". figures are built as
+# plain dicts with the template embedded, so no plotly express or
+# update_layout/update_xaxes validation runs per figure.
+import plotly.graph_objects as go
+import plotly.io as pio
+
+MAIN_COLOR = "#2b4b78"
+AXIS_LINE_COLOR = "#AEAAAA"
+
+# points above which scatter plots use WebGL (same as plotly express)
+WEBGL_POINTS = 1000
+
+_axis_style = dict(
+    showline = True,
+    linewidth = 0.5,
+    linecolor = AXIS_LINE_COLOR,
+    showgrid = False,
+    zeroline = False,
+    automargin = True,
+)
+
+pio.templates["medisight"] = go.layout.Template(
+    layout = dict(
+        paper_bgcolor = "#ffffff",
+        plot_bgcolor = "#ffffff",
+        font = dict(color = "#2a3f5f"),
+        colorway = [MAIN_COLOR],
+        hovermode = "closest",
+        xaxis = _axis_style,
+        yaxis = _axis_style,
+    )
+)
+
+# template as JSON, embedded in every figure dict
+_template = pio.templates["medisight"].to_plotly_json()
+
+
+def _layout(x_title, y_title, **layout):
+    return dict(
+        template = _template,
+        xaxis = dict(title = dict(text = x_title)),
+        yaxis = dict(title = dict(text = y_title)),
+        **layout
+    )
+
+
+# bars of counts (histogram when widths of bins are given)
+def bar_figure(x, y, x_title, y_title = "count", width = None, category = False):
+    trace = dict(
+        type = "bar",
+        x = x,
+        y = y,
+        marker = dict(color = MAIN_COLOR),
+    )
+    if width is not None:
+        trace["width"] = width
+
+    layout = _layout(x_title, y_title, bargap = 0)
+    if category:
+        layout["xaxis"]["type"] = "category"
+    return dict(data = [trace], layout = layout)
+
+
+# scatter plot of points
+def scatter_figure(x, y, x_title, y_title):
+    trace = dict(
+        type = "scattergl" if len(x) > WEBGL_POINTS else "scatter",
+        x = x,
+        y = y,
+        mode = "markers",
+        marker = dict(color = MAIN_COLOR, size = 4),
+    )
+    return dict(data = [trace], layout = _layout(x_title, y_title))
+
+
+# line chart (uirevision keeps the zoom when its data is patched)
+def line_figure(x, y, x_title, y_title, uirevision = None):
+    trace = dict(
+        type = "scatter",
+        x = x,
+        y = y,
+        mode = "lines",
+        line = dict(color = MAIN_COLOR),
+    )
+    return dict(data = [trace], layout = _layout(x_title, y_title, uirevision = uirevision))
+
+
+# heatmap of density grid with outliers overlaid
+def density_figure(grid, x_title, y_title):
+    data = [
+        dict(
+            type = "heatmap",
+            x = grid["x"],
+            y = grid["y"],
+            z = grid["z"],
+            colorscale = [[0, "#DBEBF1"], [1, MAIN_COLOR]],
+            colorbar = dict(title = dict(text = "count")),
+        )
+    ]
+    if len(grid["outlier_x"]):
+        data.append(
+            dict(
+                type = "scattergl",
+                x = grid["outlier_x"],
+                y = grid["outlier_y"],
+                mode = "markers",
+                marker = dict(color = MAIN_COLOR, size = 4),
+                showlegend = False,
+            )
+        )
+    return dict(data = data, layout = _layout(x_title, y_title))
+
+
+# heatmap of correlation matrix (DataFrame of columns x columns)
+def correlation_figure(matrix, title):
+    data = [
+        dict(
+            type = "heatmap",
+            x = list(matrix.columns),
+            y = list(matrix.index),
+            z = matrix.to_numpy(),
+            zmin = -1,
+            zmax = 1,
+            colorscale = [[0, "#DC5258"], [0.5, "#ffffff"], [1, MAIN_COLOR]],
+            colorbar = dict(title = dict(text = title)),
+            hovertemplate = "%{x} × %{y}<br>" + title + " = %{z:.2f}<extra></extra>",
+            xgap = 1,
+            ygap = 1,
+        )
+    ]
+    layout = _layout("", "", height = 720)
+    layout["xaxis"].update(type = "category", tickangle = -45)
+    layout["yaxis"].update(type = "category", autorange = "reversed")
+    return dict(data = data, layout = layout)
@@ -0,0 +1,62 @@
+# frequency tables of qualitative columns
+# string columns are already dictionary-encoded (categorical) when the
+# dataset is loaded; other qualitative columns are encoded on first use.
+# counts come from one bincount over the codes, and relative and
+# cumulative frequencies are derived from them. results are cached per
+# (dataset, column).
+import numpy as np
+import pandas as pd
+
+from binning import categorical_histogram
+from compact import display_values
+from datastore import derived_result
+from sampling import proportion_intervals
+
+
+# (values, counts) of column in value order, computed once per column
+def value_counts_dataset(dataset_id, df, col):
+    return derived_result(
+        dataset_id,
+        ("value-counts", col),
+        lambda: categorical_histogram(df[col]),
+        keep = True,
+    )
+
+
+# frequency table (count, relative and cumulative relative frequency)
+# in descending order of count
+def frequency_table(col, labels, counts):
+    order = np.argsort(-counts, kind = "stable")
+    order = order[counts[order] > 0]
+    relative = counts[order] / max(counts.sum(), 1)
+    return pd.DataFrame({
+        col: display_values(labels[order]),
+        '度数': counts[order],
+        '相対度数': relative.round(2),
+        '累積相対度数': np.cumsum(relative).round(2)
+    })
+
+
+# frequency table of column, computed once per column
+def frequency_table_dataset(dataset_id, df, col):
+    return derived_result(
+        dataset_id,
+        ("frequency-table", col),
+        lambda: frequency_table(col, *value_counts_dataset(dataset_id, df, col)),
+        keep = True,
+    )
+
+
+# frequency table estimated from counts of a sample: counts scaled to the
+# dataset, and relative frequencies with their 95% intervals
+def estimated_frequency_table(col, labels, counts, scale, population):
+    order = np.argsort(-counts, kind = "stable")
+    order = order[counts[order] > 0]
+    relative = counts[order] / max(counts.sum(), 1)
+    low, high = proportion_intervals(counts, population)
+    return pd.DataFrame({
+        col: display_values(labels[order]),
+        '推定度数': np.round(counts[order] * scale).astype(np.int64),
+        '相対度数': relative.round(2),
+        '95%信頼区間': ["{:.2f}–{:.2f}".format(l, h) for l, h in zip(low[order], high[order])]
+    })
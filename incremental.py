@@ -0,0 +1,295 @@
+# incremental append of rows with mergeable statistics
+# each dataset can keep a summary of its columns that merges with new rows
+# without the old ones: count, mean and sums of powers of deviations
+# (M2, M3, M4) plus min and max of numeric columns, histogram bins and
+# frequency maps. appending rows merges the summary of the base dataset
+# with one of the new rows (time proportional to the new rows) and seeds
+# the statistics, histograms and value counts of the appended dataset,
+# kept with its columnar cache so every worker shows the same values.
+# quartiles and median of appended datasets are interpolated from the
+# merged histogram bins, and the mode of columns with too many values for
+# a frequency map is the center of the fullest bin; approximate_statistics
+# tells which values are approximated, to mark them in the stats table.
+import math
+
+import numpy as np
+import pandas as pd
+
+from binning import HISTOGRAM_BIN_RULE, HISTOGRAM_NBINS, MAX_NBINS, histogram_dataset, numeric_histograms
+from datastore import append_file, derived_result, get_dataset, keep_derived
+from compact import display_values
+from descriptive import STATS_COLUMNS, describe_dataset, describe_numeric, float_values
+from frequency import value_counts_dataset
+
+# numeric columns keep a frequency map (for the mode) up to this many values
+MAX_FREQUENCY_VALUES = 10000
+
+# statistics interpolated from histogram bins after an append
+HISTOGRAM_STATISTICS = ["median", "q25", "q50", "q75"]
+
+
+# moments of numeric columns from their descriptive statistics
+def _moments_from_describe(describe):
+    n = describe["count"].to_numpy(dtype = float)
+    m2 = describe["std"].to_numpy(dtype = float) ** 2 * np.maximum(n - 1, 0) / np.maximum(n, 1)
+    with np.errstate(invalid = "ignore"):
+        m3 = np.nan_to_num(describe["skew"].to_numpy(dtype = float) * m2 ** 1.5)
+        m4 = np.nan_to_num((describe["kurtosis"].to_numpy(dtype = float) + 3.0) * m2 ** 2)
+    return pd.DataFrame({
+        "count": n,
+        "mean": describe["mean"].to_numpy(dtype = float),
+        "M2": np.nan_to_num(m2 * n),
+        "M3": m3 * n,
+        "M4": m4 * n,
+        "min": describe["min"].to_numpy(dtype = float),
+        "max": describe["max"].to_numpy(dtype = float),
+    }, index = describe.index)
+
+
+# moments of numeric columns of (new) rows
+def _moments(df, columns):
+    values = float_values(df[columns])
+    valid = ~np.isnan(values)
+    n = valid.sum(axis = 0).astype(float)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean = np.where(valid, values, 0.0).sum(axis = 0) / n
+        deviation = np.where(valid, values - mean, 0.0)
+        deviation2 = deviation * deviation
+        minimum = np.where(valid, values, np.inf).min(axis = 0, initial = np.inf)
+        maximum = np.where(valid, values, -np.inf).max(axis = 0, initial = -np.inf)
+    return pd.DataFrame({
+        "count": n,
+        "mean": mean,
+        "M2": deviation2.sum(axis = 0),
+        "M3": (deviation2 * deviation).sum(axis = 0),
+        "M4": (deviation2 * deviation2).sum(axis = 0),
+        "min": np.where(n > 0, minimum, np.nan),
+        "max": np.where(n > 0, maximum, np.nan),
+    }, index = columns)
+
+
+# moments of the union of two sets of rows (Pébay's formulas)
+def _merge_moments(a, b):
+    na, nb = a["count"].to_numpy(), b["count"].to_numpy()
+    n = na + nb
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean_a, mean_b = a["mean"].to_numpy(), b["mean"].to_numpy()
+        delta = np.nan_to_num(mean_b - mean_a)
+        mean = np.where(nb == 0, mean_a, np.where(na == 0, mean_b, mean_a + delta * nb / n))
+        m2a, m2b = a["M2"].to_numpy(), b["M2"].to_numpy()
+        m3a, m3b = a["M3"].to_numpy(), b["M3"].to_numpy()
+        m2 = m2a + m2b + delta ** 2 * na * nb / n
+        m3 = (
+            m3a + m3b
+            + delta ** 3 * na * nb * (na - nb) / n ** 2
+            + 3.0 * delta * (na * m2b - nb * m2a) / n
+        )
+        m4 = (
+            a["M4"].to_numpy() + b["M4"].to_numpy()
+            + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+            + 6.0 * delta ** 2 * (na * na * m2b + nb * nb * m2a) / n ** 2
+            + 4.0 * delta * (na * m3b - nb * m3a) / n
+        )
+    return pd.DataFrame({
+        "count": n,
+        "mean": mean,
+        "M2": np.nan_to_num(m2),
+        "M3": np.nan_to_num(m3),
+        "M4": np.nan_to_num(m4),
+        "min": np.fmin(a["min"].to_numpy(), b["min"].to_numpy()),
+        "max": np.fmax(a["max"].to_numpy(), b["max"].to_numpy()),
+    }, index = a.index)
+
+
+# histogram with values added, extending the bins of the same width on
+# either side if values are out of range (the last bin includes its right
+# edge); beyond MAX_NBINS bins, groups of adjacent bins are summed
+def _merge_histogram(edges, counts, values):
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return edges, counts
+    width = edges[1] - edges[0]
+    k = len(counts)
+    index = np.floor((values - edges[0]) / width).astype(np.int64)
+    index[(index == k) & (values <= edges[-1])] = k - 1
+
+    low = min(int(index.min()), 0)
+    high = max(int(index.max()) + 1, k)
+    factor = max(1, math.ceil((high - low) / MAX_NBINS))
+    low = low // factor * factor
+    nbins = math.ceil((high - low) / factor)
+    merged = (
+        np.bincount((np.arange(k) - low) // factor, weights = counts, minlength = nbins)
+        + np.bincount((index - low) // factor, minlength = nbins)
+    ).astype(np.int64)
+    return edges[0] + width * (low + factor * np.arange(nbins + 1)), merged
+
+
+# counts of values of column (index: plain values, also of categoricals;
+# float32 values as their shortest decimal)
+def _frequency_map(series):
+    counts = series.value_counts(dropna = True)
+    counts.index = display_values(np.asarray(counts.index))
+    return counts
+
+
+# summary of all columns of dataset (computed once, from cached statistics)
+def _summarize(dataset_id, df):
+    describe = describe_dataset(dataset_id, df)
+    frequencies = {}
+    for col in df.columns:
+        if col in describe.index:
+            if df[col].nunique() > MAX_FREQUENCY_VALUES:
+                frequencies[col] = None
+                continue
+            frequencies[col] = _frequency_map(df[col])
+        else:
+            labels, counts = value_counts_dataset(dataset_id, df, col)
+            frequencies[col] = pd.Series(counts, index = labels)
+    return {
+        "moments": _moments_from_describe(describe),
+        "histograms": histogram_dataset(dataset_id, df),
+        "frequencies": frequencies,
+    }
+
+
+# mergeable summary of dataset, computed once per dataset
+def summary_dataset(dataset_id, df):
+    return derived_result(dataset_id, "summary", lambda: _summarize(dataset_id, df), keep = True)
+
+
+# summary merged with new rows
+def merge_summary(summary, new_rows):
+    columns = list(summary["moments"].index)
+    moments = _merge_moments(summary["moments"], _moments(new_rows, columns))
+
+    histograms = dict(summary["histograms"])
+    for col in columns:
+        values = float_values(new_rows[[col]])[:, 0]
+        if col in histograms:
+            histograms[col] = _merge_histogram(*histograms[col], values)
+        elif not np.isnan(values).all():
+            # no values before: bins of the new values
+            histograms.update(numeric_histograms(new_rows[[col]], describe_numeric(new_rows[[col]])))
+
+    frequencies = {}
+    for col, frequency in summary["frequencies"].items():
+        if frequency is None:
+            frequencies[col] = None
+            continue
+        merged = frequency.add(_frequency_map(new_rows[col]), fill_value = 0).astype(np.int64)
+        merged = merged[merged > 0]
+        frequencies[col] = None if col in columns and len(merged) > MAX_FREQUENCY_VALUES else merged
+
+    return {
+        "moments": moments,
+        "histograms": histograms,
+        "frequencies": frequencies,
+    }
+
+
+# quantile q interpolated in histogram bins
+def _histogram_quantile(edges, counts, q):
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    cumulative = np.cumsum(counts)
+    target = q * total
+    i = int(np.searchsorted(cumulative, target))
+    i = min(i, len(counts) - 1)
+    before = cumulative[i] - counts[i]
+    fraction = (target - before) / counts[i] if counts[i] else 0.0
+    return edges[i] + (edges[i + 1] - edges[i]) * fraction
+
+
+# statistics of numeric columns from summary (as describe_numeric)
+def summary_describe(summary):
+    moments = summary["moments"]
+    n = moments["count"].to_numpy()
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        m2 = moments["M2"].to_numpy() / n
+        std = np.sqrt(moments["M2"].to_numpy() / (n - 1))
+        skew = moments["M3"].to_numpy() / n / m2 ** 1.5
+        kurtosis = moments["M4"].to_numpy() / n / m2 ** 2 - 3.0
+
+    rows = {name: [] for name in ("mode", "q25", "q50", "q75")}
+    for col in moments.index:
+        edges, counts = summary["histograms"].get(col, (np.array([np.nan, np.nan]), np.zeros(1)))
+        for name, q in (("q25", 0.25), ("q50", 0.5), ("q75", 0.75)):
+            rows[name].append(_histogram_quantile(edges, counts, q))
+
+        frequency = summary["frequencies"].get(col)
+        if frequency is not None and len(frequency):
+            # most frequent value (smallest one if tied)
+            top = frequency[frequency == frequency.max()]
+            rows["mode"].append(float(top.index.min()))
+        elif counts.sum():
+            i = int(np.argmax(counts))
+            rows["mode"].append((edges[i] + edges[i + 1]) / 2)
+        else:
+            rows["mode"].append(np.nan)
+
+    result = pd.DataFrame({
+        "count": n,
+        "mean": moments["mean"].to_numpy(),
+        "median": rows["q50"],
+        "mode": rows["mode"],
+        "max": moments["max"].to_numpy(),
+        "min": moments["min"].to_numpy(),
+        "std": std,
+        "skew": skew,
+        "kurtosis": kurtosis,
+        "q25": rows["q25"],
+        "q50": rows["q50"],
+        "q75": rows["q75"],
+    }, index = moments.index)
+    return result[STATS_COLUMNS]
+
+
+# statistics of numeric columns approximated from the merged summary
+# ({column: [statistic names]}, empty if the values are exact)
+def approximate_statistics(dataset_id):
+    return derived_result(dataset_id, "approximate-statistics", lambda: None, keep = True) or {}
+
+
+# keep summary of dataset and the results derived from it, in memory and
+# with the columnar cache
+def _seed_dataset(dataset_id, summary):
+    results = {
+        "summary": summary,
+        "describe": summary_describe(summary),
+        ("histograms", HISTOGRAM_BIN_RULE, HISTOGRAM_NBINS): {
+            col: hist for col, hist in summary["histograms"].items() if hist[1].sum() > 0
+        },
+        "approximate-statistics": {
+            col: HISTOGRAM_STATISTICS + (["mode"] if summary["frequencies"].get(col) is None else [])
+            for col in summary["moments"].index
+        },
+    }
+    for col, frequency in summary["frequencies"].items():
+        if frequency is None:
+            continue
+        try:
+            frequency = frequency.sort_index()
+        except TypeError:
+            pass
+        results[("value-counts", col)] = (np.asarray(frequency.index), frequency.to_numpy())
+    keep_derived(dataset_id, results)
+
+
+# append rows of uploaded file to dataset base_id
+# the statistics of the appended dataset are merged from the summary of the
+# base dataset and the new rows, if both have the same numeric columns
+# return dataset id and DataFrame of all rows
+def append_rows(base_id, path, filename = ""):
+    base = get_dataset(base_id)
+    if base is None:
+        raise KeyError(base_id)
+    summary = summary_dataset(base_id, base)
+
+    dataset_id, df = append_file(base_id, path, filename)
+    new_rows = df.iloc[len(base):]
+    numeric = new_rows.select_dtypes(include = ["number", "bool"]).columns
+    if list(numeric) == list(summary["moments"].index):
+        _seed_dataset(dataset_id, merge_summary(summary, new_rows))
+    return dataset_id, df
@@ -0,0 +1,240 @@
+# ingestion of uploaded files
+# the format is detected from magic bytes, then from the filename: CSV,
+# gzip or zip compressed CSV, Parquet and Feather. files are parsed straight
+# from the file on disk, without decoding them to one Python str first;
+# compressed CSV is decompressed as a stream while parsed.
+# the encoding of CSV is detected on a prefix: BOM, UTF-8, then CP932
+# (Shift-JIS exports of hospital systems).
+# the multithreaded pyarrow engine is used where pyarrow is installed, and
+# the C engine otherwise or when pyarrow cannot parse the file. Parquet and
+# Feather need pyarrow, and read only the requested columns.
+# dates pyarrow returns as datetime.date values become datetime64 columns,
+# and clock times (datetime.time values) strings, as read by the C engine.
+import codecs
+import gzip
+import logging
+import os
+import time
+import zipfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
+# parser engine: "auto" (pyarrow if installed), "pyarrow" or "c"
+CSV_ENGINE = os.environ.get("MEDISIGHT_CSV_ENGINE", "auto")
+
+# bytes of the prefix the encoding is detected on
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+# encodings tried in order on the prefix
+CANDIDATE_ENCODINGS = ["utf-8", "cp932"]
+
+_boms = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# (magic bytes, format)
+_magics = [
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "feather"),
+    (b"\x1f\x8b", "gzip"),
+    (b"PK\x03\x04", "zip"),
+]
+
+# (filename suffix, format)
+_suffixes = [
+    (".parquet", "parquet"),
+    (".feather", "feather"),
+    (".arrow", "feather"),
+    (".gz", "gzip"),
+    (".zip", "zip"),
+]
+
+
+# format of file from its first bytes, or from its filename
+# ("csv", "gzip", "zip", "parquet" or "feather")
+def detect_format(prefix, filename = ""):
+    for magic, file_format in _magics:
+        if prefix.startswith(magic):
+            return file_format
+    name = (filename or "").lower()
+    for suffix, file_format in _suffixes:
+        if name.endswith(suffix):
+            return file_format
+    return "csv"
+
+
+# encoding of bytes from their prefix
+# (a character cut at the end of the prefix is not an error)
+def detect_encoding(prefix):
+    for bom, encoding in _boms:
+        if prefix.startswith(bom):
+            return encoding
+
+    for encoding in CANDIDATE_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final = False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    # fails in the parser with the usual error
+    return "utf-8"
+
+
+# binary stream of source (path)
+def _open(source):
+    return open(source, "rb")
+
+
+# csv member of zip archive (the first one, or the only member)
+def _zip_member(archive):
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    csv_names = [name for name in names if name.lower().endswith(".csv")]
+    if not csv_names and len(names) != 1:
+        raise ValueError("no csv file in zip archive")
+    return (csv_names or names)[0]
+
+
+# function opening decompressed CSV stream of source
+def _csv_opener(source, file_format):
+    @contextmanager
+    def opener():
+        with _open(source) as raw:
+            if file_format == "gzip":
+                with gzip.GzipFile(fileobj = raw) as f:
+                    yield f
+            elif file_format == "zip":
+                with zipfile.ZipFile(raw) as archive:
+                    with archive.open(_zip_member(archive)) as f:
+                        yield f
+            else:
+                yield raw
+    return opener
+
+
+def _engines():
+    if CSV_ENGINE == "c" or (CSV_ENGINE == "auto" and not HAS_PYARROW):
+        return ["c"]
+    return ["pyarrow", "c"]
+
+
+def _report(file_format, encoding, engine, nbytes, seconds):
+    report = {
+        "format": file_format,
+        "encoding": encoding,
+        "engine": engine,
+        "bytes": nbytes,
+        "seconds": seconds,
+        "mb_per_s": nbytes / 1e6 / seconds if seconds > 0 else float("inf"),
+    }
+    logger.info(
+        "parsed %d bytes (%s, %s, %s engine) in %.3fs: %.1f MB/s",
+        nbytes, file_format, encoding, engine, seconds, report["mb_per_s"],
+    )
+    return report
+
+
+# columns of bytes values: pyarrow does not raise on bytes invalid in the
+# encoding, it returns them as bytes
+def _bytes_columns(df):
+    return [
+        col for col in df.columns
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna = True) in ("bytes", "mixed")
+    ]
+
+
+# columns of datetime.date values as datetime64, and of datetime.time values
+# as strings (pyarrow reads date32 and time32 columns as Python objects)
+def _convert_objects(df):
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(df[col], skipna = True)
+        if inferred == "date":
+            df[col] = pd.to_datetime(df[col])
+        elif inferred == "time":
+            df[col] = df[col].map(lambda value: value.isoformat(), na_action = "ignore")
+    return df
+
+
+# parse CSV stream of opener with encoding
+# return DataFrame and report (format, encoding, engine, bytes, seconds, MB/s)
+def _parse(opener, file_format, nbytes, encoding, columns):
+    engines = _engines()
+    start = time.perf_counter()
+    for engine in engines:
+        try:
+            with opener() as f:
+                df = pd.read_csv(f, encoding = encoding, engine = engine, usecols = columns)
+            invalid = _bytes_columns(df) if engine == "pyarrow" else []
+            if invalid:
+                raise UnicodeDecodeError(encoding, b"", 0, 0, "invalid bytes in column {!r}".format(invalid[0]))
+            break
+        except UnicodeDecodeError:
+            # parsed again with another encoding
+            raise
+        except Exception:
+            # files pyarrow cannot parse are parsed by the C engine
+            if engine == engines[-1]:
+                raise
+            logger.warning("%s engine failed, parsing again with the next engine", engine, exc_info = True)
+    seconds = time.perf_counter() - start
+    return df, _report(file_format, encoding, engine, nbytes, seconds)
+
+
+# parse CSV with the encoding detected on its prefix
+# (an ASCII prefix looks like UTF-8, so CP932 is tried if UTF-8 fails later,
+# also when pyarrow returned bytes values)
+def _parse_csv(source, file_format, nbytes, columns):
+    opener = _csv_opener(source, file_format)
+    with opener() as f:
+        encoding = detect_encoding(f.read(ENCODING_SAMPLE_BYTES))
+    try:
+        return _parse(opener, file_format, nbytes, encoding, columns)
+    except UnicodeDecodeError:
+        if encoding != "utf-8":
+            raise
+        return _parse(opener, file_format, nbytes, "cp932", columns)
+
+
+# read Parquet or Feather (only columns, if given)
+def _read_columnar_format(source, file_format, nbytes, columns):
+    if not HAS_PYARROW:
+        raise ValueError("pyarrow is required to read {} files".format(file_format))
+
+    start = time.perf_counter()
+    with _open(source) as f:
+        if file_format == "parquet":
+            df = pd.read_parquet(f, columns = columns)
+        else:
+            df = pd.read_feather(f, columns = columns)
+    seconds = time.perf_counter() - start
+    return df, _report(file_format, None, "pyarrow", nbytes, seconds)
+
+
+def _read(source, prefix, nbytes, filename, columns):
+    file_format = detect_format(prefix, filename)
+    if file_format in ("parquet", "feather"):
+        df, report = _read_columnar_format(source, file_format, nbytes, columns)
+    else:
+        df, report = _parse_csv(source, file_format, nbytes, columns)
+    return _convert_objects(df), report
+
+
+# read uploaded file on disk (format detected from it or from filename)
+# columns: names of columns to read (all if None)
+# return DataFrame and report of parse
+def read_table_file(path, filename = "", columns = None):
+    with open(path, "rb") as f:
+        prefix = f.read(ENCODING_SAMPLE_BYTES)
+    return _read(path, prefix, os.path.getsize(path), filename, columns)
@@ -0,0 +1,192 @@
+# lazy, paginated rendering of per-variable cards
+# a "view" button only returns the list of columns; the cards of a page are
+# built when the page is shown. time to first chart does not depend on the
+# number of columns.
+# built cards are kept in the result cache under the key of their card, so
+# clicking a view button again or reopening a dataset does not rebuild them:
+# a page whose cards are all cached is answered by the worker right away.
+# other pages are built by background callbacks in processes of the local
+# DiskcacheManager, so long pages do not hit the worker timeout. cards are
+# built in parallel on the cards executor; the page shows its progress and
+# the cards that are ready, and the job is cancelled when the page is left
+# for another one or the cancel inputs (the view button) change.
+# a job process exits with the job, so what it computes must outlive it:
+# cards go to the on-disk tier of the result cache, small derived results
+# (statistics, histograms, ...) to the columnar cache, and the stages it
+# timed are sent back and recorded by the worker. large derived results
+# (sort orders, longitudinal axes) are computed again by later jobs.
+# in preview mode, cards estimated from a sample are shown first and
+# replaced one by one as the exact cards are built.
+import math
+import os
+import tempfile
+import time
+from functools import partial
+
+import dash
+import dash_bootstrap_components as dbc
+import diskcache
+from dash import html, dcc, Input, Output, State, callback, ctx, DiskcacheManager
+
+from executor import submit_ordered
+from result_cache import cached_result, lookup_result
+from timing import collected_stages, record_stages
+
+# number of cards of one page
+CARDS_PER_PAGE = int(os.environ.get("MEDISIGHT_CARDS_PER_PAGE", 10))
+
+# directory of results and progress of background callbacks
+BACKGROUND_DIR = os.environ.get(
+    "MEDISIGHT_BACKGROUND_DIR",
+    os.path.join(tempfile.gettempdir(), "medisight-background")
+)
+
+background_manager = DiskcacheManager(diskcache.Cache(BACKGROUND_DIR))
+
+
+# card of column from the result cache (built if not cached)
+# card_key(params, col) returns None when the card must not be cached
+def _cached_card(build_card, card_key, params, col):
+    key = card_key(params, col)
+    if key is None:
+        return build_card(params, col)
+    return cached_result(key, lambda: build_card(params, col))
+
+
+# cards of columns from the result cache (None if any card is not cached)
+def _cached_cards(card_key, params, columns):
+    cards = []
+    for col in columns:
+        key = card_key(params, col)
+        card = None if key is None else lookup_result(key)
+        if card is None:
+            return None
+        cards.append(card)
+    return cards
+
+
+def _page_columns(params, page):
+    start = ((page or 1) - 1) * CARDS_PER_PAGE
+    return params["columns"][start:start + CARDS_PER_PAGE]
+
+
+# pagination and space of cards of columns
+# params (dataset id, selected variables, ...) are passed to build_card
+def paginated_cards(prefix, params, columns):
+    return html.Div(
+        [
+            dcc.Store(
+                id = prefix + "-params",
+                data = dict(params, columns = columns)
+            ),
+            # page built by the background job
+            dcc.Store(
+                id = prefix + "-job"
+            ),
+            # stages timed by the background job
+            dcc.Store(
+                id = prefix + "-stages"
+            ),
+            dbc.Pagination(
+                id = prefix + "-pagination",
+                active_page = 1,
+                max_value = max(1, math.ceil(len(columns) / CARDS_PER_PAGE)),
+                fully_expanded = False,
+                first_last = True,
+                previous_next = True,
+            ),
+            # shown while the page is built
+            html.Div(
+                [
+                    html.P(
+                        id = prefix + "-progress-text",
+                        style = {
+                            "color": "#2b4b78"
+                        }
+                    ),
+                    html.Div(
+                        id = prefix + "-partial-cards"
+                    ),
+                ],
+                id = prefix + "-progress",
+                style = {
+                    "display": "none"
+                }
+            ),
+            html.Div(
+                id = prefix + "-cards"
+            ),
+        ]
+    )
+
+
+def _progress_text(done, total, preview = False):
+    if preview:
+        return "概算を表示中：正確な値を計算中（{}/{}列）".format(done, total)
+    return "グラフを作成中（{}/{}列）".format(done, total)
+
+
+# register callbacks of pages
+# build_card(params, col) returns the contents of one card, and
+# card_key(params, col) the key of the card in the result cache
+# changes of cancel inputs stop a page being built
+# build_preview(params, col) returns the card estimated from a sample (None
+# if not sampled), shown first when params["preview"] is set
+def register_lazy_cards(prefix, build_card, card_key, cancel = (), build_preview = None):
+    build = partial(_cached_card, build_card, card_key)
+
+    # cached pages right away, other pages by the background job
+    @callback(
+        Output(prefix + "-cards", "children"),
+        Output(prefix + "-job", "data"),
+        Input(prefix + "-pagination", "active_page"),
+        Input(prefix + "-stages", "data"),
+        State(prefix + "-params", "data"),
+    )
+    def view_page(active_page, stages, params):
+        if ctx.triggered_id == prefix + "-stages":
+            record_stages(stages)
+            return dash.no_update, dash.no_update
+
+        cards = _cached_cards(card_key, params, _page_columns(params, active_page))
+        if cards is not None:
+            return cards, dash.no_update
+        return dash.no_update, {"page": active_page or 1, "requested": time.time()}
+
+    @callback(
+        Output(prefix + "-cards", "children", allow_duplicate = True),
+        Output(prefix + "-stages", "data"),
+        Input(prefix + "-job", "data"),
+        State(prefix + "-params", "data"),
+        background = True,
+        manager = background_manager,
+        progress = [
+            Output(prefix + "-progress-text", "children"),
+            Output(prefix + "-partial-cards", "children"),
+        ],
+        running = [
+            (Output(prefix + "-progress", "style"), {"display": "block"}, {"display": "none"}),
+            (Output(prefix + "-cards", "style"), {"display": "none"}, {"display": "block"}),
+        ],
+        cancel = [Input(prefix + "-pagination", "active_page")] + list(cancel),
+        prevent_initial_call = True,
+    )
+    def build_page(set_progress, job, params):
+        columns = _page_columns(params, job["page"])
+
+        with collected_stages() as stages:
+            # cards from samples first, if the dataset is sampled
+            previews = []
+            if build_preview is not None and params.get("preview"):
+                previews = [future.result() for future in submit_ordered(partial(build_preview, params), columns)]
+                if any(card is None for card in previews):
+                    previews = []
+            preview = bool(previews)
+            set_progress((_progress_text(0, len(columns), preview), previews))
+
+            # cards are built in parallel and shown in column order
+            cards = []
+            for future in submit_ordered(partial(build, params), columns):
+                cards.append(future.result())
+                set_progress((_progress_text(len(cards), len(columns), preview), cards + previews[len(cards):]))
+        return cards, stages
@@ -0,0 +1,166 @@
+# cache of rendered results (cards with figures and tables)
+# results are kept serialized as JSON under a key such as
+# (dataset id, chart kind, column, axis variable, axis type, bin parameters),
+# with LRU eviction under a byte budget. results are also written to the
+# on-disk tier (MEDISIGHT_RESULT_CACHE_DIR, disabled if set empty), which is
+# shared by workers, restarts and the processes of background callbacks:
+# cards built by a page job are found there by the worker afterwards.
+# files on disk are keyed with the cache version, so cards of another
+# release are not served.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+from timing import timed
+from version import CACHE_VERSION
+
+# memory budget of serialized results (bytes)
+RESULT_CACHE_BUDGET_BYTES = int(os.environ.get("MEDISIGHT_RESULT_CACHE_BYTES", 256 * 1024 ** 2))
+
+# directory of the on-disk tier (disabled if empty)
+RESULT_CACHE_DIR = os.environ.get(
+    "MEDISIGHT_RESULT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "medisight-results")
+)
+
+# disk budget of the on-disk tier (bytes)
+RESULT_DISK_BUDGET_BYTES = int(os.environ.get("MEDISIGHT_RESULT_DISK_BYTES", 2 * 1024 ** 3))
+
+# the on-disk tier is pruned once per this many writes
+PRUNE_INTERVAL = 100
+
+# key -> JSON, least recently used first
+_results = OrderedDict()
+_lock = threading.Lock()
+_counters = {
+    "hits": 0,
+    "misses": 0,
+    "disk_hits": 0,
+    "evictions": 0,
+}
+_total_bytes = 0
+_writes = 0
+
+
+# file of key in the on-disk tier (of this cache version only)
+def _disk_path(key):
+    name = hashlib.sha256(repr((CACHE_VERSION, key)).encode("utf-8")).hexdigest()
+    return os.path.join(RESULT_CACHE_DIR, name + ".json")
+
+
+def _read_disk(key):
+    if not RESULT_CACHE_DIR:
+        return None
+    try:
+        with open(_disk_path(key), encoding = "utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# remove least recently written results over the disk budget
+def _prune_disk():
+    entries = []
+    for entry in os.scandir(RESULT_CACHE_DIR):
+        if entry.name.endswith(".json"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RESULT_DISK_BUDGET_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _write_disk(key, serialized):
+    global _writes
+    if not RESULT_CACHE_DIR:
+        return
+    os.makedirs(RESULT_CACHE_DIR, exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = RESULT_CACHE_DIR, suffix = ".tmp")
+    with os.fdopen(fd, "w", encoding = "utf-8") as f:
+        f.write(serialized)
+    os.replace(tmp_path, _disk_path(key))
+
+    with _lock:
+        _writes += 1
+        prune = _writes % PRUNE_INTERVAL == 0
+    if prune:
+        _prune_disk()
+
+
+# keep serialized result in memory, evicting least recently used ones
+def _keep(key, serialized):
+    global _total_bytes
+    with _lock:
+        if key in _results:
+            _total_bytes -= len(_results.pop(key))
+        _results[key] = serialized
+        _total_bytes += len(serialized)
+        while _total_bytes > RESULT_CACHE_BUDGET_BYTES and len(_results) > 1:
+            _, evicted = _results.popitem(last = False)
+            _total_bytes -= len(evicted)
+            _counters["evictions"] += 1
+
+
+# serialized result of key from memory or the on-disk tier (None if not
+# cached), counted as hit, disk hit or miss
+def _lookup(key):
+    with _lock:
+        serialized = _results.get(key)
+        if serialized is not None:
+            _results.move_to_end(key)
+            _counters["hits"] += 1
+            return serialized
+
+    serialized = _read_disk(key)
+    with _lock:
+        _counters["disk_hits" if serialized is not None else "misses"] += 1
+    if serialized is not None:
+        _keep(key, serialized)
+    return serialized
+
+
+# cached result of key (None if not cached), without computing it
+def lookup_result(key):
+    serialized = _lookup(key)
+    return None if serialized is None else json.loads(serialized)
+
+
+# result of key, computed by compute() only if not cached
+# (returned as JSON-compatible dict, as dash serializes it)
+def cached_result(key, compute):
+    serialized = _lookup(key)
+    if serialized is not None:
+        return json.loads(serialized)
+
+    result = compute()
+    with timed("serialize"):
+        serialized = to_json_plotly(result)
+    _keep(key, serialized)
+    _write_disk(key, serialized)
+    return json.loads(serialized)
+
+
+# counters and size of the cache
+def cache_info():
+    with _lock:
+        return dict(
+            _counters,
+            entries = len(_results),
+            bytes = _total_bytes,
+            budget_bytes = RESULT_CACHE_BUDGET_BYTES,
+        )
@@ -0,0 +1,149 @@
+# reproducible samples of large datasets for the fast preview
+# row positions are drawn once per dataset, seeded by the dataset id, so
+# every worker previews the same rows: uniform, or stratified by a
+# qualitative column with proportional allocation (every value keeps at
+# least one row). columns of more than MAX_STRATA values (ids, free text)
+# are sampled uniformly. estimates from a sample come with 95% confidence
+# intervals: normal approximation with finite population correction for
+# means and proportions, order statistics for quantiles and Fisher's z for
+# correlations.
+import math
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from binning import categorical_histogram, numeric_histograms
+from datastore import derived_result
+from descriptive import describe_numeric
+
+# rows of the sample (datasets up to this size are not sampled)
+PREVIEW_ROWS = int(os.environ.get("MEDISIGHT_PREVIEW_ROWS", 50000))
+
+# qualitative columns with more values are not used as strata
+MAX_STRATA = int(os.environ.get("MEDISIGHT_PREVIEW_MAX_STRATA", 1000))
+
+# quantile of the standard normal distribution for 95% intervals
+Z_95 = 1.959963984540054
+
+
+# whether previews of dataset come from a sample
+def is_sampled(df):
+    return len(df) > PREVIEW_ROWS
+
+
+def _rng(dataset_id, stratify):
+    return np.random.default_rng([
+        int(dataset_id[:16], 16),
+        zlib.crc32(str(stratify).encode("utf-8")),
+    ])
+
+
+# positions of size rows drawn from each value of series in proportion
+# (uniform if series has more than MAX_STRATA values)
+def _stratified_positions(series, size, rng):
+    codes, _ = pd.factorize(series, use_na_sentinel = False)
+    counts = np.bincount(codes)
+    if len(counts) > MAX_STRATA:
+        return rng.choice(len(series), size, replace = False)
+    allocation = np.clip(np.round(counts * size / len(series)), 1, counts).astype(np.intp)
+
+    # rows grouped by value in random order, the first rows of each value taken
+    permutation = rng.permutation(len(series))
+    order = permutation[np.argsort(codes[permutation], kind = "stable")]
+    rank = np.arange(len(series)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[rank < np.repeat(allocation, counts)]
+
+
+# sorted row positions of the sample of dataset, drawn once per stratify column
+def sample_positions(dataset_id, df, stratify = None):
+    def draw():
+        n_rows = len(df)
+        if n_rows <= PREVIEW_ROWS:
+            return np.arange(n_rows)
+        rng = _rng(dataset_id, stratify)
+        if stratify is None:
+            positions = rng.choice(n_rows, PREVIEW_ROWS, replace = False)
+        else:
+            positions = _stratified_positions(df[stratify], PREVIEW_ROWS, rng)
+        return np.sort(positions)
+
+    return derived_result(dataset_id, ("sample", stratify), draw, keep = True)
+
+
+# columns of the sample of dataset
+def sample_frame(dataset_id, df, columns, stratify = None):
+    return df[columns].take(sample_positions(dataset_id, df, stratify))
+
+
+# finite population correction of sample of n rows from population rows
+def _fpc(n, population):
+    return math.sqrt(max(1.0 - n / population, 0.0)) if population else 0.0
+
+
+# 95% intervals of mean and quartiles of population from sample values
+# return {statistic: (low, high)}
+def interval_estimates(values, population):
+    values = np.sort(values[~np.isnan(values)])
+    n = len(values)
+    if n < 2:
+        return {}
+
+    fpc = _fpc(n, population)
+    half = Z_95 * values.std(ddof = 1) / math.sqrt(n) * fpc
+    mean = values.mean()
+    intervals = {"mean": (mean - half, mean + half)}
+
+    # ranks of order statistics around n * q (binomial approximation)
+    for name, q in (("q25", 0.25), ("median", 0.5), ("q75", 0.75)):
+        spread = Z_95 * math.sqrt(n * q * (1 - q)) * fpc
+        low = int(np.clip(math.floor(n * q - spread), 0, n - 1))
+        high = int(np.clip(math.ceil(n * q + spread), 0, n - 1))
+        intervals[name] = (values[low], values[high])
+    intervals["q50"] = intervals["median"]
+    return intervals
+
+
+# 95% intervals of proportions of population from sample counts
+# return (low, high) arrays
+def proportion_intervals(counts, population):
+    n = max(int(counts.sum()), 1)
+    p = counts / n
+    half = Z_95 * np.sqrt(p * (1 - p) / n) * _fpc(n, population)
+    return np.clip(p - half, 0, 1), np.clip(p + half, 0, 1)
+
+
+# 95% interval of Pearson correlation r of n pairs (Fisher's z)
+def correlation_interval(r, n):
+    if n < 4 or not np.isfinite(r) or abs(r) >= 1:
+        return (r, r)
+    z = math.atanh(r)
+    half = Z_95 / math.sqrt(n - 3)
+    return (math.tanh(z - half), math.tanh(z + half))
+
+
+# values and counts of column in the sample, with the scale of counts to
+# the dataset (rows of dataset per row of sample)
+def sample_value_counts(dataset_id, df, col):
+    sample = sample_frame(dataset_id, df, [col])
+    labels, counts = categorical_histogram(sample[col])
+    return labels, counts, len(df) / max(len(sample), 1)
+
+
+# statistics and histogram (counts scaled to the dataset) of numeric column
+# estimated from the sample, with 95% intervals
+# return (describe, histograms, intervals) as describe_numeric,
+# numeric_histograms and interval_estimates
+def sample_statistics(dataset_id, df, col):
+    sample = sample_frame(dataset_id, df, [col])
+    describe = describe_numeric(sample)
+    scale = len(df) / max(len(sample), 1)
+    histograms = {
+        c: (edges, counts * scale)
+        for c, (edges, counts) in numeric_histograms(sample, describe).items()
+    }
+    if col not in describe.index:
+        return describe, histograms, {}
+    values = sample[col].to_numpy(dtype = np.float64, na_value = np.nan)
+    return describe, histograms, interval_estimates(values, len(df))
@@ -0,0 +1,56 @@
+# per-dataset sort-order index
+# the argsort of each column is computed lazily once per dataset and cached,
+# so callers take sorted rows or columns by position instead of sorting
+# (and copying) the whole DataFrame again.
+import numpy as np
+
+from datastore import derived_result
+
+
+# stable ascending order of column (missing values last)
+def _argsort(series):
+    return series.reset_index(drop = True).sort_values(
+        kind = "stable",
+        na_position = "last",
+    ).index.to_numpy()
+
+
+# row positions of dataset sorted by column
+def sorted_positions(dataset_id, df, col, ascending = True):
+    order = derived_result(dataset_id, ("argsort", col), lambda: _argsort(df[col]))
+    if ascending:
+        return order
+
+    # descending with missing values still last
+    n_valid = int(df[col].notna().sum())
+    return np.concatenate([order[:n_valid][::-1], order[n_valid:]])
+
+
+# values of columns taken in the sorted order of column "by"
+# (only the requested columns are gathered, the frame is not copied)
+def sorted_columns(dataset_id, df, by, columns):
+    order = sorted_positions(dataset_id, df, by)
+    return {col: df[col].to_numpy()[order] for col in columns}
+
+
+# average ranks (1-based, ties averaged) of numeric column, from its cached
+# sort order (NaN for missing values)
+def column_ranks(dataset_id, df, col):
+    def ranks():
+        order = sorted_positions(dataset_id, df, col)
+        values = df[col].to_numpy(dtype = np.float64, na_value = np.nan)[order]
+        n_valid = int(np.count_nonzero(~np.isnan(values)))
+        values = values[:n_valid]
+
+        # runs of equal values share the mean of their positions
+        change = np.ones(n_valid, dtype = bool)
+        change[1:] = values[1:] != values[:-1]
+        starts = np.flatnonzero(change)
+        ends = np.append(starts[1:], n_valid)
+        run = np.cumsum(change) - 1
+
+        result = np.full(len(order), np.nan)
+        result[order[:n_valid]] = ((starts + ends + 1) / 2.0)[run]
+        return result
+
+    return derived_result(dataset_id, ("rank", col), ranks)
@@ -0,0 +1,192 @@
+# server-side paging, sorting and filtering of the data table
+# only the visible page is sent to the browser.
+# filter_query uses the syntax of dash_table (e.g. "{age} >= 60 && {sex} = M")
+import math
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from compact import display_dates, display_values
+from datastore import date_formats
+from sort_index import sorted_positions
+
+# number of (dataset, filter, sort) row orders kept for paging
+ORDER_CACHE_SIZE = 16
+
+_filter_pattern = re.compile(
+    r"^\{(?P<name>[^}]*)\}\s*"
+    r"(?P<operator>is not blank|is blank|[si]?(?:>=|<=|!=|<|>|=|eq|ne|lt|le|gt|ge|contains|datestartswith))"
+    r"\s*(?P<value>.*)$"
+)
+
+# word operators -> symbols
+_operator_symbols = {
+    "eq": "=",
+    "ne": "!=",
+    "lt": "<",
+    "le": "<=",
+    "gt": ">",
+    "ge": ">=",
+}
+
+# operators comparing text (values are kept as typed, 60 not 60.0)
+_string_operators = ("contains", "datestartswith")
+
+# (dataset id, filter query, sort by) -> row positions
+_orders = OrderedDict()
+_lock = threading.Lock()
+
+
+# split one part of filter query into column name, operator, value
+# return None if the part is not supported
+def split_filter_part(filter_part):
+    match = _filter_pattern.match(filter_part.strip())
+    if match is None:
+        return None
+
+    operator = match.group("operator")
+    case_insensitive = False
+    if operator[0] in "si" and operator not in ("is blank", "is not blank"):
+        case_insensitive = operator[0] == "i"
+        operator = operator[1:]
+    operator = _operator_symbols.get(operator, operator)
+
+    value = match.group("value").strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"', "`"):
+        value = value[1:-1].replace("\\" + value[0], value[0])
+    elif operator not in _string_operators:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+
+    return match.group("name"), operator, value, case_insensitive
+
+
+# boolean mask of rows matching one filter part
+def _filter_mask(series, operator, value, case_insensitive):
+    if operator == "is blank":
+        return series.isna().to_numpy()
+    if operator == "is not blank":
+        return series.notna().to_numpy()
+
+    if operator == "contains":
+        return series.astype(str).str.contains(
+            str(value),
+            case = not case_insensitive,
+            regex = False,
+        ).to_numpy()
+    if operator == "datestartswith":
+        return series.astype(str).str.startswith(str(value)).to_numpy()
+
+    if case_insensitive and isinstance(value, str) and not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str).str.lower()
+        value = value.lower()
+
+    try:
+        if operator == "=":
+            mask = series == value
+        elif operator == "!=":
+            mask = series != value
+        elif operator == "<":
+            mask = series < value
+        elif operator == "<=":
+            mask = series <= value
+        elif operator == ">":
+            mask = series > value
+        else:
+            mask = series >= value
+    except TypeError:
+        # e.g. numeric column compared with text
+        return np.zeros(len(series), dtype = bool)
+    return mask.fillna(False).to_numpy(dtype = bool)
+
+
+# row positions after filtering and sorting (None if all rows in order)
+def _row_order(df, dataset_id, filter_query, sort_by):
+    positions = None
+    mask = None
+
+    if filter_query:
+        mask = np.ones(len(df), dtype = bool)
+        for filter_part in filter_query.split(" && "):
+            part = split_filter_part(filter_part)
+            if part is None or part[0] not in df.columns:
+                continue
+            name, operator, value, case_insensitive = part
+            mask &= _filter_mask(df[name], operator, value, case_insensitive)
+        positions = np.flatnonzero(mask)
+
+    if sort_by:
+        sort_by = [col for col in sort_by if col["column_id"] in df.columns]
+    # one column: filter the cached order of the column instead of sorting
+    if sort_by and len(sort_by) == 1:
+        order = sorted_positions(
+            dataset_id,
+            df,
+            sort_by[0]["column_id"],
+            ascending = sort_by[0]["direction"] == "asc",
+        )
+        positions = order if mask is None else order[mask[order]]
+    elif sort_by:
+        columns = [col["column_id"] for col in sort_by]
+        keys = df[columns] if positions is None else df[columns].iloc[positions]
+        order = keys.reset_index(drop = True).sort_values(
+            by = columns,
+            ascending = [col["direction"] == "asc" for col in sort_by],
+            kind = "mergesort",
+        ).index.to_numpy()
+        positions = order if positions is None else positions[order]
+
+    return positions
+
+
+# cached row positions for paging through the same query
+def _cached_row_order(df, dataset_id, filter_query, sort_by):
+    key = (
+        dataset_id,
+        filter_query or "",
+        tuple((col["column_id"], col["direction"]) for col in sort_by or []),
+    )
+    with _lock:
+        if key in _orders:
+            _orders.move_to_end(key)
+            return _orders[key]
+
+    positions = _row_order(df, dataset_id, filter_query, sort_by)
+
+    with _lock:
+        _orders[key] = positions
+        while len(_orders) > ORDER_CACHE_SIZE:
+            _orders.popitem(last = False)
+    return positions
+
+
+# records of one page and number of pages
+def query_page(df, dataset_id, page_current, page_size, sort_by, filter_query):
+    positions = _cached_row_order(df, dataset_id, filter_query, sort_by)
+    n_rows = len(df) if positions is None else len(positions)
+
+    start = (page_current or 0) * page_size
+    end = start + page_size
+    if positions is None:
+        page = df.iloc[start:end]
+    else:
+        page = df.iloc[positions[start:end]]
+
+    # float32 columns as their shortest decimal
+    float32_columns = [col for col in page.columns if page[col].dtype == np.float32]
+    if float32_columns:
+        page = page.assign(**{col: display_values(page[col]) for col in float32_columns})
+
+    # date columns in the format they were uploaded in
+    date_columns = [col for col in page.columns if page[col].dtype.kind == "M"]
+    if date_columns:
+        formats = date_formats(dataset_id)
+        page = page.assign(**{col: display_dates(page[col], formats.get(col)) for col in date_columns})
+
+    page_count = max(1, math.ceil(n_rows / page_size))
+    return page.to_dict("records"), page_count
@@ -0,0 +1,9 @@
+import pytest
+
+import columnar
+
+
+# columnar cache of each test in its own directory
+@pytest.fixture(autouse = True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, "CACHE_DIR", str(tmp_path / "datasets"))
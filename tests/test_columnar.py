@@ -0,0 +1,24 @@
+import pandas as pd
+
+import columnar
+from columnar import read_derived, write_columnar, write_derived
+
+DATASET_ID = "0" * 64
+
+
+def test_derived_results_of_another_version_are_not_read(monkeypatch):
+    write_columnar(pd.DataFrame({"age": [60, 45]}), DATASET_ID)
+    write_derived(DATASET_ID, "describe", {"mode": 60})
+    assert read_derived(DATASET_ID, "describe") == {"mode": 60}
+
+    monkeypatch.setattr(columnar, "CACHE_VERSION", "other")
+    assert read_derived(DATASET_ID, "describe") is None
+
+
+def test_unreadable_derived_results_are_not_read():
+    write_columnar(pd.DataFrame({"age": [60, 45]}), DATASET_ID)
+    path = columnar._derived_path(columnar._dataset_dir(DATASET_ID), "describe")
+    with open(path, "wb") as f:
+        # pickle of a class that does not exist (as from another pandas)
+        f.write(b"cpandas\nGone\n.")
+    assert read_derived(DATASET_ID, "describe") is None
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from compact import compact_column, display_dates, display_values
+from descriptive import describe_numeric
+
+
+def test_float32_only_when_exact():
+    assert compact_column(pd.Series([36.6, 37.1, np.nan, 0.0])).dtype == np.float32
+    assert compact_column(pd.Series([36.6] * 100000 + [1234567.89])).dtype == np.float64
+
+
+def test_display_values_are_shortest_decimals():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([
+        rng.normal(37, 2, 10000),
+        rng.random(1000) * 1e-30,
+        rng.random(1000) * 1e30,
+        [np.nan, np.inf, -np.inf, 0.0, 36.6],
+    ]).astype(np.float32)
+    np.testing.assert_array_equal(display_values(values), values.astype(str).astype(np.float64))
+
+
+def test_statistics_of_float32_columns_as_uploaded():
+    df = pd.DataFrame({"temp": compact_column(pd.Series([36.6, 36.6, 37.1]))})
+    stats = describe_numeric(df).loc["temp"]
+    assert stats["mode"] == 36.6
+    assert stats["min"] == 36.6
+
+
+def test_display_dates():
+    dates = pd.Series(pd.to_datetime(["2024-01-01", None]))
+    assert list(display_dates(dates).fillna("")) == ["2024-01-01", ""]
+    assert list(display_dates(dates, "%Y/%m/%d").fillna("")) == ["2024/01/01", ""]
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from datastore import append_file, load_file
+from table_query import query_page
+
+
+def test_append_to_compacted_dataset(tmp_path):
+    base_path = tmp_path / "base.csv"
+    base_path.write_text("visit_date,temp,ward\n2024/01/01,36.6,A\n2024/01/02,37.1,A\n2024/01/03,36.6,B\n")
+    rows_path = tmp_path / "rows.csv"
+    rows_path.write_text("visit_date,temp,ward\n2024/01/05,38.2,B\n")
+
+    base_id, base = load_file(str(base_path), "base.csv")
+    assert base["temp"].dtype == np.float32
+    assert base["visit_date"].dtype.kind == "M"
+
+    dataset_id, df = append_file(base_id, str(rows_path), "rows.csv")
+    assert len(df) == 4
+    assert df["temp"].dtype == np.float32
+    assert df["visit_date"].dtype.kind == "M"
+    assert list(df["visit_date"]) == list(pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-05"]))
+
+    records, _ = query_page(df, dataset_id, 0, 10, [], "{temp} = 36.6")
+    assert [record["temp"] for record in records] == [36.6, 36.6]
+    assert [record["visit_date"] for record in records] == ["2024/01/01", "2024/01/03"]
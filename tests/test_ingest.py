@@ -0,0 +1,22 @@
+import pandas as pd
+import pytest
+
+import ingest
+from compact import compact_frame
+from ingest import read_table_file
+
+
+@pytest.mark.skipif(not ingest.HAS_PYARROW, reason = "pyarrow is not installed")
+def test_dated_csv_with_pyarrow_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "CSV_ENGINE", "pyarrow")
+    path = tmp_path / "visits.csv"
+    path.write_text("visit_date,time,temp,ward\n2024-01-01,08:30:00,36.6,A\n2024-01-02,09:00:00,37.1,A\n")
+
+    df, report = read_table_file(str(path), "visits.csv")
+    assert report["engine"] == "pyarrow"
+    compacted, _ = compact_frame(df)
+
+    assert compacted["visit_date"].dtype == "datetime64[ns]"
+    assert list(compacted["visit_date"]) == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02")]
+    assert list(compacted["time"]) == ["08:30:00", "09:00:00"]
+    assert compacted["ward"].dtype == "category"
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from table_query import query_page, split_filter_part
+
+
+def test_split_filter_part():
+    assert split_filter_part("{age} >= 60") == ("age", ">=", 60.0, False)
+    assert split_filter_part("{age} ge 60") == ("age", ">=", 60.0, False)
+    assert split_filter_part("{sex} = 'M'") == ("sex", "=", "M", False)
+    assert split_filter_part("{name} icontains abc") == ("name", "contains", "abc", True)
+    assert split_filter_part("{age} contains 60") == ("age", "contains", "60", False)
+    assert split_filter_part("{visit_date} datestartswith 2024") == ("visit_date", "datestartswith", "2024", False)
+    assert split_filter_part("{age} is blank") == ("age", "is blank", "", False)
+    assert split_filter_part("age > 60") is None
+
+
+def _filtered(df, filter_query):
+    records, _ = query_page(df, "test-" + filter_query, 0, 100, [], filter_query)
+    return records
+
+
+def test_query_page_filters():
+    df = pd.DataFrame({
+        "age": [60, 160, 45],
+        "sex": ["M", "F", "M"],
+        "visit_date": pd.to_datetime(["2024-01-01", "2023-12-31", "2024-02-01"]),
+    })
+    assert [record["age"] for record in _filtered(df, "{age} contains 60")] == [60, 160]
+    assert [record["age"] for record in _filtered(df, "{age} >= 60 && {sex} = M")] == [60]
+    assert [record["age"] for record in _filtered(df, "{visit_date} datestartswith 2024")] == [60, 45]
+    assert [record["visit_date"] for record in _filtered(df, "{sex} = F")] == ["2023-12-31"]
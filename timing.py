@@ -0,0 +1,207 @@
+# timing of stages of callbacks and uploads
+# code of a stage runs in `with timed("parse"):`. durations are added to
+# histograms of this worker and, within a request, sent back as a
+# Server-Timing header ("dash" is the rest of the request: dispatch and
+# JSON serialization). /metrics shows the histograms and cache counters in
+# the Prometheus text format. when MEDISIGHT_PROFILE_SLOW_SECONDS is set,
+# requests are profiled with cProfile and slower ones are saved as .prof.
+# stages timed in the processes of background callbacks are collected and
+# recorded again by the worker that receives their result.
+import cProfile
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, g, has_request_context, request
+
+# upper bounds of histogram buckets (seconds)
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# requests slower than this are profiled (disabled if empty)
+PROFILE_SLOW_SECONDS = os.environ.get("MEDISIGHT_PROFILE_SLOW_SECONDS", "")
+
+# directory of saved profiles
+PROFILE_DIR = os.environ.get(
+    "MEDISIGHT_PROFILE_DIR",
+    os.path.join(tempfile.gettempdir(), "medisight-profiles")
+)
+
+# paths of requests that are timed
+TIMED_PATHS = ("/_dash-update-component", "/upload")
+
+metrics_blueprint = Blueprint("metrics", __name__)
+
+# (metric, label) -> [bucket counts..., sum, count]
+_histograms = {}
+_lock = threading.Lock()
+
+# only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+# lists collecting the stages timed in this process
+_collectors = []
+
+
+def _observe(metric, label, seconds):
+    with _lock:
+        if metric == "medisight_stage_seconds":
+            for stages in _collectors:
+                stages.append([label, seconds])
+        values = _histograms.get((metric, label))
+        if values is None:
+            values = _histograms[(metric, label)] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+
+# time code of stage
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _observe("medisight_stage_seconds", stage, seconds)
+        # stages run by executor threads have no request
+        if has_request_context() and "timings" in g:
+            g.timings.append((stage, seconds))
+
+
+# list of [stage, seconds] of the stages timed within the block (in any
+# thread of this process), to be recorded by another process
+@contextmanager
+def collected_stages():
+    stages = []
+    with _lock:
+        _collectors.append(stages)
+    try:
+        yield stages
+    finally:
+        with _lock:
+            _collectors[:] = [c for c in _collectors if c is not stages]
+
+
+# record stages collected by collected_stages in another process
+def record_stages(stages):
+    for stage, seconds in stages or []:
+        _observe("medisight_stage_seconds", stage, seconds)
+
+
+def _is_timed(path):
+    return path.startswith(TIMED_PATHS)
+
+
+# name of callback of dash request (its output)
+def _callback_name():
+    body = request.get_json(silent = True) or {}
+    return str(body.get("output", "unknown"))
+
+
+@metrics_blueprint.before_app_request
+def start_timing():
+    if not _is_timed(request.path):
+        return
+    g.timings = []
+    g.request_start = time.perf_counter()
+    if PROFILE_SLOW_SECONDS and _profile_lock.acquire(blocking = False):
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+
+def _save_profile(profile, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok = True)
+    name = "{}-{:.3f}s-{}.prof".format(
+        time.strftime("%Y%m%d-%H%M%S"),
+        seconds,
+        re.sub(r"[^0-9A-Za-z_-]+", "_", request.path.strip("/"))[:64],
+    )
+    profile.dump_stats(os.path.join(PROFILE_DIR, name))
+
+
+@metrics_blueprint.after_app_request
+def finish_timing(response):
+    if "request_start" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_start
+
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+        try:
+            if seconds >= float(PROFILE_SLOW_SECONDS):
+                _save_profile(profile, seconds)
+        finally:
+            _profile_lock.release()
+
+    if request.path == "/_dash-update-component":
+        _observe("medisight_callback_seconds", _callback_name(), seconds)
+    else:
+        _observe("medisight_request_seconds", request.path.split("/")[1], seconds)
+
+    # stages of the same name are summed
+    durations = {}
+    for stage, stage_seconds in g.timings:
+        durations[stage] = durations.get(stage, 0.0) + stage_seconds
+    durations["dash"] = max(seconds - sum(durations.values()), 0.0)
+    entries = ["{};dur={:.1f}".format(stage, d * 1000) for stage, d in durations.items()]
+    entries.append("total;dur={:.1f}".format(seconds * 1000))
+    response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+def _label_value(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _histogram_lines():
+    label_names = {
+        "medisight_stage_seconds": "stage",
+        "medisight_callback_seconds": "callback",
+        "medisight_request_seconds": "endpoint",
+    }
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+
+    lines = []
+    for metric, label_name in label_names.items():
+        lines.append("# TYPE {} histogram".format(metric))
+        for (name, label), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            label = "{}=\"{}\"".format(label_name, _label_value(label))
+            for bound, count in zip(BUCKETS, values):
+                lines.append("{}_bucket{{{},le=\"{}\"}} {}".format(metric, label, bound, count))
+            lines.append("{}_bucket{{{},le=\"+Inf\"}} {}".format(metric, label, values[-1]))
+            lines.append("{}_sum{{{}}} {}".format(metric, label, values[-2]))
+            lines.append("{}_count{{{}}} {}".format(metric, label, values[-1]))
+    return lines
+
+
+def _cache_lines(prefix, info):
+    lines = []
+    for key in ("hits", "misses", "disk_hits", "evictions"):
+        lines.append("# TYPE {}_{}_total counter".format(prefix, key))
+        lines.append("{}_{}_total {}".format(prefix, key, info[key]))
+    for key in ("entries", "bytes", "budget_bytes"):
+        lines.append("# TYPE {}_{} gauge".format(prefix, key))
+        lines.append("{}_{} {}".format(prefix, key, info[key]))
+    return lines
+
+
+# metrics of this worker in the Prometheus text format
+@metrics_blueprint.route("/metrics")
+def metrics():
+    import datastore
+    import result_cache
+
+    lines = _histogram_lines()
+    lines += _cache_lines("medisight_dataset_cache", datastore.cache_info())
+    lines += _cache_lines("medisight_result_cache", result_cache.cache_info())
+    return Response("\n".join(lines) + "\n", mimetype = "text/plain; version=0.0.4")
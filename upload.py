@@ -0,0 +1,146 @@
+# streaming upload endpoint
+# files are sent as raw chunks (or one multipart form) and written to a
+# temporary file, so the upload never goes through base64 in a JSON callback.
+# the response is only a dataset handle for the dash side.
+# /datasets/<dataset_id>/report returns how a dataset was parsed and the
+# memory saved per column.
+# the file may be CSV (plain, .gz or .zip), Parquet or Feather; "columns"
+# (comma separated) restricts the columns that are read, and "append_to"
+# (dataset id) appends the rows of the file to that dataset.
+import logging
+import os
+import re
+import tempfile
+import time
+
+from flask import Blueprint, jsonify, request
+
+from datastore import BLOCK_SIZE, compaction_report, get_dataset, ingest_report, load_file
+from incremental import append_rows
+
+# directory of partially uploaded files (shared by gunicorn workers)
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "medisight-uploads")
+
+# partial uploads older than this are removed (seconds)
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+upload_blueprint = Blueprint("upload", __name__)
+
+_upload_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+# path of the partial file of upload id (None if id is invalid)
+def _upload_path(upload_id):
+    if not _upload_id_pattern.match(upload_id):
+        return None
+    os.makedirs(UPLOAD_DIR, exist_ok = True)
+    return os.path.join(UPLOAD_DIR, upload_id + ".part")
+
+
+# remove partial files of abandoned uploads
+def _remove_stale_uploads():
+    now = time.time()
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > STALE_UPLOAD_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+# copy stream to file block by block
+def _copy_stream(stream, f):
+    while True:
+        block = stream.read(BLOCK_SIZE)
+        if not block:
+            break
+        f.write(block)
+
+
+# parse uploaded file and return dataset handle
+def _dataset_handle(path, upload_id, filename):
+    # columns to read (comma separated, all if not given)
+    columns = request.args.get("columns")
+    columns = columns.split(",") if columns else None
+    # dataset the rows are appended to (new dataset if not given)
+    append_to = request.args.get("append_to")
+    try:
+        if append_to:
+            dataset_id, _ = append_rows(append_to, path, filename)
+        else:
+            dataset_id, _ = load_file(path, filename, columns)
+    except Exception:
+        logger.exception("failed to read uploaded file %r", filename)
+        return jsonify(
+            upload_id = upload_id,
+            error = "※行を追加できませんでした" if append_to else "※ファイルを読み込めませんでした",
+        ), 400
+    finally:
+        os.remove(path)
+
+    return jsonify(
+        upload_id = upload_id,
+        dataset_id = dataset_id,
+        filename = filename,
+    )
+
+
+# receive one chunk of upload id at offset
+@upload_blueprint.route("/upload/<upload_id>", methods = ["POST"])
+def upload_chunk(upload_id):
+    path = _upload_path(upload_id)
+    if path is None:
+        return jsonify(error = "invalid upload id"), 400
+
+    offset = request.args.get("offset", 0, type = int)
+    if offset == 0:
+        _remove_stale_uploads()
+
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        _copy_stream(request.stream, f)
+        received = f.tell()
+
+    return jsonify(upload_id = upload_id, received = received)
+
+
+# all chunks received, parse the file from disk
+@upload_blueprint.route("/upload/<upload_id>/complete", methods = ["POST"])
+def upload_complete(upload_id):
+    path = _upload_path(upload_id)
+    if path is None or not os.path.exists(path):
+        return jsonify(error = "invalid upload id"), 400
+
+    return _dataset_handle(path, upload_id, request.args.get("filename", ""))
+
+
+# receive whole file as multipart form (field "file")
+@upload_blueprint.route("/upload", methods = ["POST"])
+def upload_multipart():
+    file = request.files.get("file")
+    if file is None:
+        return jsonify(error = "file is required"), 400
+
+    upload_id = os.urandom(16).hex()
+    path = _upload_path(upload_id)
+    with open(path, "wb") as f:
+        _copy_stream(file.stream, f)
+
+    return _dataset_handle(path, upload_id, file.filename)
+
+
+# parse report (format, encoding, engine, MB/s) and memory saved per column
+@upload_blueprint.route("/datasets/<dataset_id>/report", methods = ["GET"])
+def dataset_report(dataset_id):
+    if get_dataset(dataset_id) is None:
+        return jsonify(error = "unknown dataset id"), 404
+
+    compaction = compaction_report(dataset_id)
+    return jsonify(
+        dataset_id = dataset_id,
+        ingest = ingest_report(dataset_id),
+        compaction = None if compaction is None else compaction.to_dict("records"),
+    )
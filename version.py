@@ -0,0 +1,24 @@
+# version of the results kept on disk
+# cards of the result cache and results derived from datasets persist
+# across restarts and deploys. their keys include CACHE_VERSION, so results
+# written by another release (SCHEMA_VERSION, MEDISIGHT_APP_VERSION) or by
+# other versions of pandas, numpy and plotly are not read but computed again.
+# increment SCHEMA_VERSION when cached results change (statistics, cards, ...).
+import os
+
+import numpy as np
+import pandas as pd
+import plotly
+
+SCHEMA_VERSION = 2
+
+# release of the app, e.g. the commit deployed (optional)
+APP_VERSION = os.environ.get("MEDISIGHT_APP_VERSION", "")
+
+CACHE_VERSION = "{}-{}-pandas{}-numpy{}-plotly{}".format(
+    SCHEMA_VERSION,
+    APP_VERSION,
+    pd.__version__,
+    np.__version__,
+    plotly.__version__,
+)